@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+
+import utils
+
+## Artifact cache manifests
+# Each cached artifact (a file, or a directory such as a Token_store) has a sidecar <artifact>.manifest.json
+# recording what it was built from: a fingerprint of each source file (size, mtime, hash), the parameters,
+# and the version of the code that built it. An artifact is reused only when all of them still match,
+# so changing one input rebuilds only the artifacts that depend on it.
+#
+#   python artifact_cache.py [dir ...]    lists the cached artifacts under dir (default ../data/) with their sizes
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+def get_manifest_filename(path):
+    return path.rstrip("/") + MANIFEST_SUFFIX
+
+def get_source_fingerprint(filename):
+    if not os.path.exists(filename):
+        return None
+    return {'size': os.path.getsize(filename),
+            'mtime': os.path.getmtime(filename),
+            'hash': utils.file_fingerprint(filename),
+           }
+
+def source_matches(filename, recorded):
+    # size and mtime unchanged means unchanged; otherwise the hash decides (e.g. a copied file)
+    # a source that is no longer on disk cannot be checked, the artifact built from it is kept
+    if not os.path.exists(filename):
+        return True
+    if recorded is None or os.path.getsize(filename) != recorded['size']:
+        return False
+    if os.path.getmtime(filename) == recorded['mtime']:
+        return True
+    return utils.file_fingerprint(filename) == recorded['hash']
+
+def make_manifest(kind, version, sources=(), params=None):
+    return {'format': 'artifact/1',
+            'kind': kind,
+            'version': version,
+            'sources': {filename: get_source_fingerprint(filename) for filename in sources},
+            'params': params if params is not None else dict(),
+            'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+           }
+
+def load_manifest(path):
+    manifest_filename = get_manifest_filename(path)
+    if not os.path.exists(manifest_filename):
+        return None
+    with open(manifest_filename) as f:
+        return json.load(f)
+
+def save_manifest(path, kind, version, sources=(), params=None):
+    # called once the artifact at path is complete
+    manifest = make_manifest(kind, version, sources, params)
+    manifest_filename = get_manifest_filename(path)
+    tmp_filename = "%s.%d.tmp" % (manifest_filename, os.getpid())
+    with open(tmp_filename, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_filename, manifest_filename)
+    return manifest
+
+def is_valid(path, kind, version, sources=(), params=None):
+    # True if the artifact at path exists and was built by this version from the same sources and params.
+    # An artifact of an older run without a manifest is adopted as is and given one.
+    if not os.path.exists(path):
+        return False
+    params = json.loads(json.dumps(params if params is not None else dict())) # as read back from json
+    manifest = load_manifest(path)
+    if manifest is None:
+        print("Cache %s has no manifest, recording its inputs" % path)
+        save_manifest(path, kind, version, sources, params)
+        return True
+    reasons = list()
+    if manifest.get('kind') != kind or manifest.get('version') != version:
+        reasons.append("version %s/%s != %s/%s" % (manifest.get('kind'), manifest.get('version'), kind, version))
+    if set(manifest.get('sources', dict())) != set(sources):
+        reasons.append("sources")
+    else:
+        reasons.extend("source %s" % filename for filename in sources if not source_matches(filename, manifest['sources'][filename]))
+    reasons.extend("param %s" % key for key in sorted(set(manifest.get('params', dict())) | set(params))
+                   if manifest.get('params', dict()).get(key) != params.get(key))
+    if reasons:
+        print("Cache %s is stale (%s), rebuilding ..." % (path, ", ".join(reasons)))
+        return False
+    return True
+
+def get_artifact_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(dirpath, filename)) for filename in filenames)
+    return size
+
+def list_artifacts(root):
+    # [(path, manifest, size)] of the artifacts with a manifest under root
+    artifacts = list()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(MANIFEST_SUFFIX):
+                continue
+            path = os.path.join(dirpath, filename[:-len(MANIFEST_SUFFIX)])
+            if os.path.isdir(path):
+                path += "/"
+            elif not os.path.exists(path):
+                continue
+            artifacts.append((path, load_manifest(path), get_artifact_size(path)))
+    return artifacts
+
+def print_artifacts(roots):
+    total = 0
+    for root in roots:
+        for path, manifest, size in list_artifacts(root):
+            print("%10.1f MB  %-18s %s  %s" % (size / 2 ** 20, "%s/%s" % (manifest['kind'], manifest['version']), manifest['created'], path))
+            total += size
+    print("%10.1f MB  total" % (total / 2 ** 20))
+
+
+if __name__ == "__main__":
+    print_artifacts(sys.argv[1:] or ["../data/"])
@@ -0,0 +1,371 @@
+import os
+import csv
+import json
+import time
+import random
+import string
+import tempfile
+import numpy as np
+from tqdm import tqdm
+
+import config
+import kg_vector_generation
+import text_to_uri
+from conceptnet_graph import ConceptNet_graph, Expansion_limits, Bitset
+
+## Synthetic data
+
+def make_synthetic_conceptnet(filename, num_edges, num_words=50000, seed=0):
+    # A tab-separated file with the same columns as conceptnet-assertions-en-5.6.0.csv
+    rng = random.Random(seed)
+    rels = ['/r/IsA', '/r/PartOf', '/r/AtLocation', '/r/RelatedTo', '/r/Synonym', '/r/HasA', '/r/UsedFor']
+    langs = ['en', 'en', 'en', 'en', 'fr', 'de']
+    with open(filename, 'w', encoding='utf8') as f:
+        for _ in range(num_edges):
+            rel = rng.choice(rels)
+            sub = '/c/%s/word%d' % (rng.choice(langs), rng.randrange(num_words))
+            obj = '/c/%s/word%d' % (rng.choice(langs), rng.randrange(num_words))
+            if rng.random() < 0.3:
+                sub += '/n'
+            weight = rng.choice([0.1, 0.5, 1.0, 1.0, 2.0, 3.464])
+            details = '{"dataset": "/d/conceptnet/4/en", "license": "cc:by/4.0", "sources": [{"contributor": "/s/contributor/omcs/bedume"}], "weight": %s}' % weight
+            f.write('/a/[%s/,%s/,%s/]\t%s\t%s\t%s\t%s\n' % (rel, sub, obj, rel, sub, obj, details))
+
+# Node labels of ConceptNet as they appear in its URIs, in several languages, for the text_to_uri golden check
+# when the ConceptNet CSV is not at hand
+CONCEPTNET_LABELS = ['dog', 'new_york_city', 'the_beatles', 'an_apple', 'to_be_or_not_to_be', 'a_test_phrase', 'to',
+                     '24_hours', '1990s', '7_eleven', '3.14', '1,000', '100%', 'catch_22', 'mp3_player', 'ak_47',
+                     "don't", "o'clock", "rock_'n'_roll", "achilles'_heel", 'mother-in-law', 'e-mail', 't-shirt',
+                     'c++', 'at&t', 'u.s.a.', 'ph.d', '#hashtag', '$5_bill', 'hello__world', '_', 'x_', 'MiXeD_CaSe',
+                     'café', 'naïve', 'crème_brûlée', 'résumé', 'jalapeño', 'façade', 'zoë', 'ñandú', 'pâte_à_choux',
+                     'straße', 'über', 'fußball_weltmeisterschaft', 'İstanbul', 'ǆemal', 'æsthetic', 'ﬁsh', 'Ａｂｃ',
+                     'собака', 'москва', 'Ελλάδα', 'φιλοσοφία', 'שלום', 'القاهرة', '٣_أيام', 'भारत', 'हिन्दी',
+                     '東京', '日本語', '猫', '北京大学', '中国人', 'ひらがな', 'カタカナ', '한국어', 'ไทย', 'x²', '½_cup',
+                     'tōkyō', 'ho_chi_minh_city', 'việt_nam', 'smörgåsbord', 'Ärger', 'ÆØÅ', 'naïve_bayes_2']
+
+def read_conceptnet_labels(filename, num_labels, seed=0):
+    # Labels of the sub and obj nodes (any language) of lines at random offsets of the ConceptNet CSV
+    rng = random.Random(seed)
+    size = os.path.getsize(filename)
+    labels = list()
+    with open(filename, 'rb') as f:
+        while len(labels) < num_labels:
+            f.seek(rng.randrange(size))
+            f.readline()
+            columns = f.readline().decode('utf8').split('\t')
+            if len(columns) < 4:
+                continue
+            for uri in columns[2:4]:
+                uri = kg_vector_generation.remove_word_sense(uri)
+                labels.append(uri[uri.rfind('/') + 1:])
+    return labels[:num_labels]
+
+def make_synthetic_terms(num_terms, seed=0):
+    # Terms of ASCII letters and digits in mixed case, separated by spaces or underscores, with the stopwords dropped
+    # by english_filter among the words. Some of them get accents, CJK, apostrophes, hyphens, dots or doubled and
+    # trailing separators, so both the ASCII fast path of text_to_uri and the wordfreq path are taken.
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    extra = "éüßñøÅİ東京한ア'’-.,&_ " + string.digits
+    stopwords = text_to_uri.STOPWORDS + text_to_uri.DROP_FIRST + ['The', 'AN', 'To']
+    terms = list()
+    for _ in range(num_terms):
+        words = [rng.choice(stopwords) if rng.random() < 0.2 else ''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+                 for _ in range(rng.randint(1, 4))]
+        term = words[0] + ''.join(rng.choice(' _') + word for word in words[1:])
+        if rng.random() < 0.5:
+            position = rng.randint(0, len(term))
+            term = term[:position] + ''.join(rng.choice(extra) for _ in range(rng.randint(1, 3))) + term[position:]
+        terms.append(term)
+    return terms
+
+## Reference implementation
+# The ConceptNet code of kg_vector_generation before the CSR graph (baseline commit), as the reference of the
+# golden checks below: all nodes and the one hop edges read in two passes over the CSV into a dict of
+# ConceptNet_node, neighbors found by recursive set unions, one KG vector per node. It has its own
+# NODES_DATA and lemmatise_dict.
+
+NODES_DATA = dict()
+lemmatise_dict = dict()
+
+class ConceptNet_node:
+    
+    def __init__(self, uri): # Create a node
+        self.uri = kg_vector_generation.remove_word_sense(uri)
+        self.label = uri[uri.rfind('/')+1:]
+        self.neighbors = {0: set([self.uri]),
+                          1: set()}
+        
+    def find_neighbors(self, hop):
+        if hop not in self.neighbors:
+            one_hop_less = self.find_neighbors(hop-1)
+            ans = set()
+            for n in one_hop_less:
+                ans = ans.union(NODES_DATA[n].find_neighbors(1))
+            ans = ans.difference(self.find_neighbors_within(hop-1))
+            self.neighbors[hop] = ans
+            print('Finish finding neighbors of ', self.uri, 'hop =', hop)
+        return self.neighbors[hop]
+    
+    def find_neighbors_within(self, hop):
+        assert hop >= 0, 'Hop number must be non-negative'
+        if hop == 0:
+            return self.neighbors[0]
+        else:
+            return self.find_neighbors(hop).union(self.find_neighbors_within(hop-1))
+
+
+def get_neighbors_of_cluster(node_set, hop):
+    ans = set()
+    for n in node_set:
+        assert n in NODES_DATA, "Invalid node " + n
+        ans = ans.union(NODES_DATA[n].find_neighbors_within(hop))
+    return ans
+
+def read_all_nodes(filename): # get all distinct uri in conceptnet (without part of speech)
+    nodes = set()
+    with open(filename, 'r', encoding = "utf8") as csvfile:
+        reader = csv.reader(csvfile, delimiter='\t')
+        for line in tqdm(reader):
+            if not line[2].startswith('/c/en/') or not line[3].startswith('/c/en/'): # only relationships with english nodes
+                continue
+            sub = kg_vector_generation.remove_word_sense(line[2])
+            obj = kg_vector_generation.remove_word_sense(line[3])
+            nodes.add(sub)
+            nodes.add(obj)
+    return nodes
+
+
+def load_one_hop_data(filename, NODES_DATA, rel_list):
+    count_edges = 0
+    with open(filename, 'r', encoding = "utf8") as csvfile:
+        reader = csv.reader(csvfile, delimiter='\t')
+        for line in tqdm(reader):
+            rel = line[1].strip()
+            if rel_list is None or rel in rel_list:
+                details = json.loads(line[4])
+                w = details['weight']
+                if w < 1.0:
+                    continue
+                if not line[2].startswith('/c/en/') or not line[3].startswith('/c/en/'): # only relationships with english nodes
+                    continue
+                sub = lemmatise_dict[kg_vector_generation.remove_word_sense(line[2])]
+                obj = lemmatise_dict[kg_vector_generation.remove_word_sense(line[3])]
+                if sub != obj:
+                    NODES_DATA[sub].neighbors[1].add(obj)
+                    NODES_DATA[obj].neighbors[1].add(sub)
+                    count_edges += 1
+    print("Total no. of registered edges =", count_edges)
+
+def get_vector_of(n, all_c_nodes, hop): # n = uri, c = Category_node
+    v = np.zeros(3 * hop + 1)
+    v[0] = 1.0 if n in all_c_nodes else 0.0
+    for i in range(hop):
+        have_hops = [n in NODES_DATA[c].find_neighbors(i+1) for c in all_c_nodes]
+        if len(have_hops) > 0:
+            v[3 * i + 1] = float(any(have_hops))
+            v[3 * i + 2] = float(sum(have_hops))
+            v[3 * i + 3] = float(np.mean(have_hops))
+        else:
+            v[3 * i + 1] = 0.0
+            v[3 * i + 2] = 0.0
+            v[3 * i + 3] = 0.0
+    return v
+
+def reference_standardized_uri(language, term):
+    # text_to_uri.standardized_uri of the baseline, every term tokenized by wordfreq
+    if not (term.startswith('/') and term.count('/') >= 2):
+        tokens = text_to_uri.simple_tokenize(term.replace('_', ' '))
+        if language == 'en':
+            tokens = text_to_uri.english_filter(tokens)
+        term = '/c/{}/{}'.format(language.lower(), '_'.join(tokens))
+    return text_to_uri.replace_numbers(term)
+
+def load_reference_graph(filename, rel_list):
+    # load_ConceptNet of the baseline without lemmatisation (synthetic nodes are their own lemmas)
+    global NODES_DATA, lemmatise_dict
+    nodes = read_all_nodes(filename)
+    lemmatise_dict = {n: n for n in nodes}
+    NODES_DATA = {n: ConceptNet_node(n) for n in nodes}
+    load_one_hop_data(filename, NODES_DATA, rel_list)
+    return NODES_DATA
+
+def load_graph(filename, rel_list, min_weight=1.0):
+    # The graph of kg_vector_generation.load_ConceptNet without lemmatisation: every relation and weight read
+    # in one pass, then the edges of rel_list with weight >= min_weight selected
+    nodes, edges = kg_vector_generation.read_ConceptNet(filename, None, min_weight=0.0)
+    nodes = sorted(nodes)
+    node_to_id = {n: idx for idx, n in enumerate(nodes)}
+    relation_names = sorted(set(rel for _, _, rel, _ in edges))
+    rel_to_id = {rel: idx for idx, rel in enumerate(relation_names)}
+    graph = ConceptNet_graph.from_id_pairs(nodes,
+                                           np.fromiter((node_to_id[sub] for sub, _, _, _ in edges), dtype=np.int64, count=len(edges)),
+                                           np.fromiter((node_to_id[obj] for _, obj, _, _ in edges), dtype=np.int64, count=len(edges)),
+                                           relations=np.fromiter((rel_to_id[rel] for _, _, rel, _ in edges), dtype=np.uint8, count=len(edges)),
+                                           weights=np.fromiter((weight for _, _, _, weight in edges), dtype=np.float64, count=len(edges)),
+                                           relation_names=relation_names)
+    return graph.subgraph(rel_list, min_weight)
+
+## Benchmarks
+
+def bench_conceptnet_ingestion(num_edges=500000):
+    # Golden check: the nodes and one hop neighbors of the graph must be those of the baseline
+    rel_list = ['/r/IsA', '/r/PartOf', '/r/AtLocation', '/r/RelatedTo']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'conceptnet.csv')
+        make_synthetic_conceptnet(filename, num_edges)
+
+        # Baseline: read_all_nodes + load_one_hop_data
+        start_time = time.time()
+        reference_nodes_data = load_reference_graph(filename, rel_list)
+        reference_time = time.time() - start_time
+
+        # Single pass: read_ConceptNet + CSR graph
+        start_time = time.time()
+        graph = load_graph(filename, rel_list)
+        graph_time = time.time() - start_time
+
+    assert set(graph.uris) == reference_nodes_data.keys()
+    for n in reference_nodes_data:
+        assert reference_nodes_data[n].neighbors[1] == graph.find_neighbors(n, 1), n
+    print("[ConceptNet ingestion] %d edges: baseline %.2fs, single pass %.2fs, speedup %.2fx" % (num_edges, reference_time, graph_time, reference_time / graph_time))
+
+def make_synthetic_node_groups(graph, seed=0):
+    rng = random.Random(seed)
+    uris = graph.uris
+    return {'the_class': [rng.choice(uris)],
+            'super_class': list(set(rng.choice(uris) for _ in range(2))),
+            'description': list(set(rng.choice(uris) for _ in range(4))),
+           }
+
+def bench_kg_vectors(num_edges=300000, num_words=30000, hop=3):
+    # Golden check: the neighbors of the class nodes and the batch feature matrix must equal those of the
+    # baseline graph and its per-node get_vector_of, which main_program pickled
+    rel_list = ['/r/IsA', '/r/PartOf', '/r/AtLocation', '/r/RelatedTo']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'conceptnet.csv')
+        make_synthetic_conceptnet(filename, num_edges, num_words)
+        kg_vector_generation.NODES_DATA = load_graph(filename, rel_list)
+        load_reference_graph(filename, rel_list)
+    node_groups = make_synthetic_node_groups(kg_vector_generation.NODES_DATA)
+    all_c_nodes = set(sum(node_groups.values(), []))
+
+    start_time = time.time()
+    all_neighbors, matrix = kg_vector_generation.get_vectors_of_node_groups(node_groups, hop)
+    batch_vectors = {n: matrix[idx] for idx, n in enumerate(all_neighbors)}
+    batch_time = time.time() - start_time
+
+    start_time = time.time()
+    reference_vectors = dict()
+    for n in get_neighbors_of_cluster(all_c_nodes, hop):
+        reference_vectors[n] = np.concatenate([get_vector_of(n, node_groups[key], hop) for key in ['the_class', 'super_class', 'description']], axis = 0)
+    reference_time = time.time() - start_time
+
+    for c in all_c_nodes:
+        for i in range(hop + 1):
+            assert NODES_DATA[c].find_neighbors(i) == kg_vector_generation.NODES_DATA.find_neighbors(c, i), (c, i)
+    assert batch_vectors.keys() == reference_vectors.keys()
+    for n in reference_vectors:
+        assert batch_vectors[n].dtype == reference_vectors[n].dtype and np.array_equal(batch_vectors[n], reference_vectors[n]), n
+    print("[KG vectors] %d neighbors: get_vector_of %.2fs, batch %.2fs, speedup %.2fx" % (len(reference_vectors), reference_time, batch_time, reference_time / batch_time))
+
+def check_expansion_limits(num_nodes=2000, num_edges=10000, hop=3, seed=0):
+    # Golden check: with max_nodes, frontier_h must still hold only nodes at distance exactly h, and a node dropped
+    # at one hop must not be met (and counted as pruned) again one hop later
+    # - seed 0 linked to 1, 2, 3, which are linked to each other: the node dropped at hop 1 is a neighbor of the kept ones
+    triangle = ConceptNet_graph.from_id_pairs(['/c/en/%d' % i for i in range(4)], [0, 0, 0, 1, 1, 2], [1, 2, 3, 2, 3, 3])
+    report = list()
+    frontiers = triangle.expand_frontiers([0], 2, limits=Expansion_limits(max_nodes=3), report=report)
+    assert [frontier.shape[0] for frontier in frontiers] == [1, 2, 0], frontiers
+    assert [r['pruned_nodes'] for r in report] == [1, 0], report
+    # - random graph: distances against the BFS without limits, pruned nodes counted once, visited left as the frontiers
+    rng = np.random.RandomState(seed)
+    graph = ConceptNet_graph.from_id_pairs(['/c/en/%d' % i for i in range(num_nodes)], rng.randint(num_nodes, size=num_edges), rng.randint(num_nodes, size=num_edges))
+    for node_id in rng.randint(num_nodes, size=20):
+        distance = {int(node): h for h, frontier in enumerate(graph.expand_frontiers([node_id], hop)) for node in frontier}
+        for max_nodes in [5, 50, 500]:
+            report = list()
+            visited = Bitset(len(graph))
+            frontiers = graph.expand_frontiers([node_id], hop, visited, limits=Expansion_limits(max_nodes=max_nodes, seed=int(node_id)), report=report)
+            for h, frontier in enumerate(frontiers):
+                assert all(distance[int(node)] == h for node in frontier), (node_id, max_nodes, h)
+            kept = np.concatenate(frontiers)
+            assert kept.shape[0] <= max_nodes
+            assert np.array_equal(np.flatnonzero(visited.contains(np.arange(len(graph)))), np.sort(kept))
+            assert sum(r['pruned_nodes'] for r in report) <= len(distance) - kept.shape[0], (node_id, max_nodes, report)
+    print("[Expansion limits] frontiers at exact distances, pruned nodes counted once")
+
+def bench_text_to_uri(num_terms=200000, seed=0):
+    # Golden check: standardized_uri (with and without its LRU cache) and standardized_uris must give the URIs of the
+    # baseline, which tokenized every term with wordfreq, on ConceptNet labels (a sample of the CSV if there is one,
+    # CONCEPTNET_LABELS otherwise) and on synthetic terms, through both the ASCII fast path and the wordfreq path
+    if os.path.exists(config.conceptnet_path):
+        labels = read_conceptnet_labels(config.conceptnet_path, num_terms // 2, seed)
+    else:
+        labels = CONCEPTNET_LABELS
+    terms = labels + make_synthetic_terms(num_terms - len(labels), seed)
+    num_fast = sum(1 for term in terms if text_to_uri.ASCII_TERM_RE.match(term))
+
+    for language in ['en', 'fr']: # english_filter only applies to English
+        start_time = time.time()
+        reference_uris = [reference_standardized_uri(language, term) for term in terms]
+        reference_time = time.time() - start_time
+
+        start_time = time.time()
+        uris = text_to_uri.standardized_uris(language, terms)
+        batch_time = time.time() - start_time
+
+        text_to_uri.standardized_uri.cache_clear()
+        cached_uris = [text_to_uri.standardized_uri(language, term) for term in terms]
+        cached_uris_again = [text_to_uri.standardized_uri(language, term) for term in labels]
+
+        for name, result in [('standardized_uris', uris), ('standardized_uri', cached_uris), ('standardized_uri (cached)', cached_uris_again)]:
+            mismatches = [(term, uri, reference_uri) for term, uri, reference_uri in zip(terms, result, reference_uris) if uri != reference_uri]
+            assert not mismatches, (name, language, mismatches[:10])
+        print("[text_to_uri] %s: %d terms (%d ConceptNet labels, %d through the ASCII fast path): wordfreq %.2fs, standardized_uris %.2fs, speedup %.2fx"
+              % (language, len(terms), len(labels), num_fast, reference_time, batch_time, reference_time / batch_time))
+    text_to_uri.standardized_uri.cache_clear()
+
+def encode_batch_loop(word_embed_mat, textlist, max_length, pad_id):
+    # prepro_encode of the controllers before dataloader.Batch_encoder: padding and a python loop over every word
+    text_array = np.zeros([len(textlist), max_length, word_embed_mat.shape[1]])
+    encode_text_seqs = np.full([len(textlist), max_length], pad_id, dtype=np.int64)
+    for idx, text in enumerate(textlist):
+        text = text[1:-1][:max_length - 1]
+        encode_text_seqs[idx, :len(text)] = text
+        for widx, word_id in enumerate(encode_text_seqs[idx]):
+            text_array[idx][widx] = word_embed_mat[word_id]
+    return encode_text_seqs, text_array
+
+def bench_batch_encoding(num_texts=20000, vocab_size=50000, batch_size=config.batch_size, max_length=config.max_length, seed=0):
+    # Golden check: the shared encoder must give the ids and embeddings of the per-word loop
+    import dataloader # needs TensorFlow and TensorLayer, unlike the ConceptNet benchmarks
+    rng = np.random.RandomState(seed)
+    word_embed_mat = rng.rand(vocab_size, config.word_embedding_dim).astype(np.float32)
+    pad_id = 0
+    textlist = [rng.randint(1, vocab_size, size=length).tolist() for length in rng.randint(3, 2 * max_length, size=num_texts)]
+    padded_id_matrix = dataloader.get_padded_ids(textlist, max_length, pad_id)
+    num_steps = num_texts // batch_size
+
+    start_time = time.time()
+    for cstep in range(num_steps):
+        loop_ids, loop_mat = encode_batch_loop(word_embed_mat, textlist[cstep * batch_size : (cstep + 1) * batch_size], max_length, pad_id)
+    loop_time = time.time() - start_time
+
+    encoder = dataloader.Batch_encoder(word_embed_mat)
+    start_time = time.time()
+    for cstep in range(num_steps):
+        ids, mat = encoder.encode(padded_id_matrix[cstep * batch_size : (cstep + 1) * batch_size])
+    encoder_time = time.time() - start_time
+
+    assert np.array_equal(ids, loop_ids) and mat.dtype == np.float32 and np.array_equal(mat, loop_mat)
+    print("[Batch encoding] %d steps of %d texts: loop %.1f steps/s, Batch_encoder %.1f steps/s, speedup %.2fx"
+          % (num_steps, batch_size, num_steps / loop_time, num_steps / encoder_time, loop_time / encoder_time))
+
+
+if __name__ == "__main__":
+    bench_conceptnet_ingestion()
+    bench_kg_vectors()
+    check_expansion_limits()
+    bench_text_to_uri()
+    bench_batch_encoding()
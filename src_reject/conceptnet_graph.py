@@ -0,0 +1,439 @@
+import os
+import json
+import numpy as np
+from tqdm import tqdm
+
+class Bitset:
+    # Fixed-size set of node ids, one bit per node
+
+    def __init__(self, size):
+        self.words = np.zeros((size + 7) // 8, dtype=np.uint8)
+
+    def contains(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        return ((self.words[ids >> 3] >> (ids & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def add(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        np.bitwise_or.at(self.words, ids >> 3, np.left_shift(1, ids & 7).astype(np.uint8))
+
+    def clear(self, ids): # unset the words holding ids (the other bits of those words are cleared too)
+        ids = np.asarray(ids, dtype=np.int64)
+        self.words[ids >> 3] = 0
+
+    def discard(self, ids): # unset only the bits of ids
+        ids = np.asarray(ids, dtype=np.int64)
+        np.bitwise_and.at(self.words, ids >> 3, np.invert(np.left_shift(1, ids & 7).astype(np.uint8)))
+
+
+class String_table:
+    # Sorted strings stored back to back as utf8 bytes, indexable like a list of str
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @staticmethod
+    def from_strings(strings): # strings must be sorted
+        encoded = [s.encode('utf8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return String_table(data, offsets)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf8')
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def index(self, s): # binary search, utf8 byte order is the same as str order
+        key = s.encode('utf8')
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.data[self.offsets[mid]:self.offsets[mid + 1]].tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self[lo] == s:
+            return lo
+        raise KeyError(s)
+
+
+class Expansion_limits:
+    # Limits on the BFS of ConceptNet_graph.expand_frontiers through hub nodes
+    # max_degree: a node with more edges than this is a hub, and only max_degree of its edges are followed:
+    #             random ones (hub_policy 'sample'), the first ones ('truncate') or none ('skip')
+    # max_nodes: memory budget, at most this many nodes in all the frontiers of one expansion (a random subset is kept)
+
+    def __init__(self, max_degree=None, hub_policy='sample', max_nodes=None, seed=0):
+        assert hub_policy in ['sample', 'truncate', 'skip'], "Invalid hub policy " + hub_policy
+        self.max_degree = max_degree
+        self.hub_policy = hub_policy
+        self.max_nodes = max_nodes
+        self.seed = seed
+
+    def __repr__(self):
+        return 'Expansion_limits(%s)' % ', '.join('%s=%r' % (key, val) for key, val in self.to_dict().items())
+
+    def __eq__(self, other):
+        return isinstance(other, Expansion_limits) and self.to_dict() == other.to_dict()
+
+    def to_dict(self):
+        return {'max_degree': self.max_degree, 'hub_policy': self.hub_policy, 'max_nodes': self.max_nodes, 'seed': self.seed}
+
+    @staticmethod
+    def from_dict(d):
+        return Expansion_limits(**d) if d is not None else None
+
+
+## ConceptNet graph in CSR form
+# Node URIs are interned to int32 ids (sorted, so ids are stable for a given node set).
+# The neighbors of node i are indices[indptr[i]:indptr[i+1]], sorted and without duplicates.
+# A graph with per-edge relations keeps one entry per (neighbor, relation) instead, so a neighbor
+# may repeat within a row; relations[e] indexes relation_names and weights[e] is the edge weight.
+
+class ConceptNet_graph:
+
+    def __init__(self, uris, indptr, indices, relations=None, weights=None, relation_names=None, uri_to_id=None):
+        # uris is either a list of str or a String_table (graph loaded from disk), sorted in both cases
+        if isinstance(uris, String_table):
+            self.uris = uris
+            self.uri_to_id = None
+        else:
+            self.uris = uris if isinstance(uris, list) else list(uris)
+            self.uri_to_id = uri_to_id if uri_to_id is not None else {uri: idx for idx, uri in enumerate(self.uris)}
+        self.indptr = indptr if indptr.dtype == np.int64 else np.asarray(indptr, dtype=np.int64)
+        self.indices = indices if indices.dtype == np.int32 else np.asarray(indices, dtype=np.int32)
+        assert self.indptr.shape[0] == len(self.uris) + 1
+        self.hop_cache = dict() # node id -> [frontier_0, ..., frontier_hop] from expand_frontiers
+        self.limits = None # Expansion_limits of every expansion, see set_expansion_limits
+        # Optional per-edge columns aligned with indices
+        self.relations = relations
+        self.weights = weights
+        self.relation_names = relation_names
+
+    @staticmethod
+    def from_edges(nodes, edges): # nodes = set of uri, edges = iterable of (sub, obj) uri pairs
+        uris = sorted(nodes)
+        uri_to_id = {uri: idx for idx, uri in enumerate(uris)}
+        pairs = np.fromiter((uri_to_id[n] for edge in edges for n in edge), dtype=np.int64).reshape(-1, 2)
+        return ConceptNet_graph.from_id_pairs(uris, pairs[:, 0], pairs[:, 1])
+
+    @staticmethod
+    def from_id_pairs(uris, sub, obj, relations=None, weights=None, relation_names=None):
+        # uris = sorted list of uri, sub/obj = arrays of node ids, one entry per edge
+        # relations/weights (optional, together) = relation id and weight of each edge
+        num_nodes = len(uris)
+        sub = np.asarray(sub, dtype=np.int64)
+        obj = np.asarray(obj, dtype=np.int64)
+        keep = sub != obj
+        sub, obj = sub[keep], obj[keep]
+        if relations is not None:
+            return ConceptNet_graph.from_relation_edges(uris, sub, obj, np.asarray(relations)[keep], np.asarray(weights)[keep], relation_names)
+
+        # Undirected: register each edge in both directions, then drop duplicates
+        keys = np.unique(np.concatenate((sub * num_nodes + obj, obj * num_nodes + sub)))
+        src = keys // num_nodes
+        dst = keys % num_nodes
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+        print("Total no. of registered edges =", keys.shape[0] // 2)
+        return ConceptNet_graph(uris, indptr, dst.astype(np.int32))
+
+    @staticmethod
+    def from_relation_edges(uris, sub, obj, relations, weights, relation_names):
+        # As from_id_pairs, but one entry per (neighbor, relation); repeated edges keep their largest weight
+        num_nodes = len(uris)
+        num_relations = len(relation_names)
+        src = np.concatenate((sub, obj))
+        dst = np.concatenate((obj, sub))
+        relations = np.concatenate((relations, relations)).astype(np.int64)
+        weights = np.concatenate((weights, weights))
+
+        keys = (src * num_nodes + dst) * num_relations + relations
+        order = np.lexsort((weights, keys))
+        keys, weights = keys[order], weights[order]
+        last = np.ones(keys.shape[0], dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        keys, weights = keys[last], weights[last]
+
+        pairs = keys // num_relations
+        src = pairs // num_nodes
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+        num_pairs = np.count_nonzero(np.diff(pairs)) + 1 if pairs.shape[0] > 0 else 0
+        print("Total no. of registered edges =", num_pairs // 2, ", with relations =", keys.shape[0] // 2)
+        return ConceptNet_graph(uris, indptr, (pairs % num_nodes).astype(np.int32),
+                                relations=(keys % num_relations).astype(np.uint8), weights=weights, relation_names=list(relation_names))
+
+    def set_expansion_limits(self, limits):
+        # The cached frontiers were expanded with the previous limits
+        if limits != self.limits:
+            self.limits = limits
+            self.hop_cache = dict()
+
+    def get_edge_mask(self, relations=None, min_weight=None):
+        # Boolean mask over the edges of the given relations (names) with weight >= min_weight, None if nothing is filtered out
+        if relations is None and min_weight is None:
+            return None
+        assert self.relations is not None, "The graph has no relation and weight columns"
+        mask = np.ones(self.indices.shape[0], dtype=bool)
+        if relations is not None:
+            mask &= np.isin(self.relations, [idx for idx, name in enumerate(self.relation_names) if name in relations])
+        if min_weight is not None:
+            mask &= self.weights >= min_weight
+        return mask
+
+    def subgraph(self, relations=None, min_weight=None):
+        # Same nodes (and ids), only the edges selected by get_edge_mask; hop frontiers are cached per subgraph
+        mask = self.get_edge_mask(relations, min_weight)
+        if mask is None:
+            return self
+        src = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.indptr))[mask]
+        indptr = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(self)), out=indptr[1:])
+        graph = ConceptNet_graph(self.uris, indptr, self.indices[mask],
+                                 relations=self.relations[mask], weights=self.weights[mask], relation_names=self.relation_names, uri_to_id=self.uri_to_id)
+        graph.limits = self.limits
+        return graph
+
+    def __len__(self):
+        return len(self.uris)
+
+    def __contains__(self, uri):
+        try:
+            self.get_id(uri)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, uri):
+        return ConceptNet_node_view(self, self.get_id(uri))
+
+    def get_id(self, uri):
+        if self.uri_to_id is None:
+            return self.uris.index(uri)
+        return self.uri_to_id[uri]
+
+    ## Snapshot
+    # A directory of .npy files plus manifest.json, loadable with np.load(mmap_mode='r'):
+    #   uris_data, uris_offsets                 String_table of the node URIs
+    #   indptr, indices                         CSR edges
+    #   relations, weights                      optional per-edge columns
+    #   frontier_seeds, frontier_level_ptr,     hop_cache: the frontiers of frontier_seeds[i] are
+    #   frontier_ptr, frontier_ids              levels frontier_level_ptr[i]:frontier_level_ptr[i+1],
+    #                                           level j holds frontier_ids[frontier_ptr[j]:frontier_ptr[j+1]]
+    # manifest.json is written last, so a directory without it is an incomplete snapshot.
+
+    def save_snapshot(self, dirname, extra_manifest=None):
+        os.makedirs(dirname, exist_ok=True)
+        manifest_filename = os.path.join(dirname, 'manifest.json')
+        if os.path.exists(manifest_filename):
+            os.remove(manifest_filename)
+
+        uris = self.uris if isinstance(self.uris, String_table) else String_table.from_strings(self.uris)
+        seeds = sorted(self.hop_cache.keys())
+        levels = [frontier for seed in seeds for frontier in self.hop_cache[seed]]
+        level_ptr = np.zeros(len(seeds) + 1, dtype=np.int64)
+        np.cumsum([len(self.hop_cache[seed]) for seed in seeds], out=level_ptr[1:])
+        frontier_ptr = np.zeros(len(levels) + 1, dtype=np.int64)
+        np.cumsum([frontier.shape[0] for frontier in levels], out=frontier_ptr[1:])
+
+        arrays = {'uris_data': uris.data,
+                  'uris_offsets': uris.offsets,
+                  'indptr': self.indptr,
+                  'indices': self.indices,
+                  'frontier_seeds': np.asarray(seeds, dtype=np.int32),
+                  'frontier_level_ptr': level_ptr,
+                  'frontier_ptr': frontier_ptr,
+                  'frontier_ids': np.concatenate(levels).astype(np.int32) if levels else np.zeros(0, dtype=np.int32),
+                 }
+        if self.relations is not None:
+            arrays['relations'] = self.relations
+        if self.weights is not None:
+            arrays['weights'] = self.weights
+        for name, array in arrays.items():
+            tmp_filename = os.path.join(dirname, '%s.%d.tmp.npy' % (name, os.getpid()))
+            np.save(tmp_filename, np.ascontiguousarray(array))
+            os.replace(tmp_filename, os.path.join(dirname, name + '.npy'))
+
+        manifest = {'format': 'conceptnet_graph/1',
+                    'num_nodes': len(self),
+                    'num_edges': int(self.indices.shape[0]),
+                    'arrays': sorted(arrays.keys()),
+                    'relation_names': self.relation_names,
+                    'expansion_limits': self.limits.to_dict() if self.limits is not None else None,
+                   }
+        manifest.update(extra_manifest or dict())
+        tmp_filename = '%s.%d.tmp' % (manifest_filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_filename, manifest_filename)
+
+    @staticmethod
+    def load_snapshot_manifest(dirname): # None if there is no complete snapshot in dirname
+        manifest_filename = os.path.join(dirname, 'manifest.json')
+        if not os.path.exists(manifest_filename):
+            return None
+        with open(manifest_filename) as f:
+            return json.load(f)
+
+    @staticmethod
+    def load_snapshot(dirname, mmap_mode='r'):
+        manifest = ConceptNet_graph.load_snapshot_manifest(dirname)
+        assert manifest is not None, "No graph snapshot in " + dirname
+        arrays = {name: np.load(os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode) for name in manifest['arrays']}
+        graph = ConceptNet_graph(String_table(arrays['uris_data'], arrays['uris_offsets']),
+                                 arrays['indptr'], arrays['indices'],
+                                 relations=arrays.get('relations'), weights=arrays.get('weights'), relation_names=manifest.get('relation_names'))
+
+        # Frontiers stay views into the memory-mapped frontier_ids, expanded with the saved limits
+        graph.limits = Expansion_limits.from_dict(manifest.get('expansion_limits'))
+        level_ptr, frontier_ptr, frontier_ids = arrays['frontier_level_ptr'], arrays['frontier_ptr'], arrays['frontier_ids']
+        for idx, seed in enumerate(arrays['frontier_seeds']):
+            graph.hop_cache[int(seed)] = [frontier_ids[frontier_ptr[j]:frontier_ptr[j + 1]] for j in range(level_ptr[idx], level_ptr[idx + 1])]
+        return graph
+
+    def get_uris(self, ids):
+        return [self.uris[idx] for idx in ids]
+
+    def get_degree(self, node_id):
+        return self.get_one_hop_ids(node_id).shape[0]
+
+    def get_one_hop_ids(self, node_id):
+        one_hop_ids = self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+        return one_hop_ids if self.relations is None else np.unique(one_hop_ids)
+
+    def gather_one_hop_ids(self, node_ids, edge_mask=None, limits=None, rng=None, report=None):
+        # Concatenated one hop neighbors of node_ids (with repeats).
+        # With limits.max_degree, only some of the edges of hub nodes are followed and report (a dict) counts the hubs and the pruned edges.
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        starts = self.indptr[node_ids]
+        lengths = self.indptr[node_ids + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        edges = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+        rows = np.repeat(np.arange(node_ids.shape[0]), lengths)
+        if edge_mask is not None:
+            keep = edge_mask[edges]
+            edges, rows = edges[keep], rows[keep]
+
+        if limits is not None and limits.max_degree is not None:
+            degrees = np.bincount(rows, minlength=node_ids.shape[0])
+            hubs = degrees > limits.max_degree
+            if hubs.any():
+                if limits.hub_policy == 'skip':
+                    keep = ~hubs[rows]
+                else:
+                    # rank of each edge within its row, in id order ('truncate') or in a random order ('sample')
+                    order = np.arange(edges.shape[0]) if limits.hub_policy == 'truncate' else np.lexsort((rng.random_sample(edges.shape[0]), rows))
+                    keep = np.empty(edges.shape[0], dtype=bool)
+                    keep[order] = np.arange(edges.shape[0]) - (np.cumsum(degrees) - degrees)[rows[order]] < limits.max_degree
+                if report is not None:
+                    report['hubs'] += int(np.count_nonzero(hubs))
+                    report['pruned_edges'] += int(edges.shape[0] - np.count_nonzero(keep))
+                edges = edges[keep]
+        return self.indices[edges]
+
+    def expand_frontiers(self, seed_ids, hop, visited=None, edge_mask=None, limits=None, report=None):
+        # Level-by-level BFS from a cluster of seed nodes, only through the edges in edge_mask if given (see get_edge_mask).
+        # Returns [frontier_0, ..., frontier_hop]; frontier_h holds the nodes whose distance to the cluster is exactly h.
+        # limits (by default self.limits) caps hubs and the number of nodes, report (a list) receives one dict of pruning counts per hop.
+        if limits is None:
+            limits = self.limits
+        rng = np.random.RandomState(limits.seed) if limits is not None else None
+        if visited is None:
+            visited = Bitset(len(self))
+        frontier = np.unique(np.asarray(seed_ids, dtype=np.int32))
+        visited.add(frontier)
+        frontiers = [frontier]
+        pruned = list() # nodes dropped by max_nodes: visited during this expansion, so they are not met again one hop later
+        num_nodes = frontier.shape[0]
+        for h in range(hop):
+            hop_report = {'hop': h + 1, 'hubs': 0, 'pruned_edges': 0, 'pruned_nodes': 0}
+            candidates = np.unique(self.gather_one_hop_ids(frontier, edge_mask, limits, rng, hop_report))
+            frontier = candidates[~visited.contains(candidates)]
+            visited.add(frontier) # every node at distance h + 1, kept or not
+            if limits is not None and limits.max_nodes is not None and num_nodes + frontier.shape[0] > limits.max_nodes:
+                room = max(limits.max_nodes - num_nodes, 0)
+                hop_report['pruned_nodes'] = frontier.shape[0] - room
+                kept = np.sort(rng.choice(frontier, room, replace=False))
+                pruned.append(np.setdiff1d(frontier, kept, assume_unique=True))
+                frontier = kept
+            frontiers.append(frontier)
+            num_nodes += frontier.shape[0]
+            if report is not None:
+                report.append(hop_report)
+        if pruned:
+            visited.discard(np.concatenate(pruned)) # visited is left holding the frontiers, as find_neighbors_of_nodes expects
+        return frontiers
+
+    def find_neighbors_of_nodes(self, node_ids, hop):
+        # One sweep over many nodes (e.g. all class nodes), sharing a single visited bitset
+        visited = Bitset(len(self))
+        node_ids = [int(node_id) for node_id in node_ids]
+        for node_id in tqdm(node_ids):
+            frontiers = self.hop_cache.get(node_id)
+            if frontiers is None or len(frontiers) <= hop:
+                frontiers = self.expand_frontiers([node_id], hop, visited)
+                self.hop_cache[node_id] = frontiers
+                for frontier in frontiers:
+                    visited.clear(frontier)
+        return {node_id: self.hop_cache[node_id] for node_id in node_ids}
+
+    def find_neighbor_ids(self, node_id, hop): # nodes exactly `hop` hops away from node_id
+        assert hop >= 0, 'Hop number must be non-negative'
+        if hop == 0:
+            return np.array([node_id], dtype=np.int32)
+        if hop == 1 and self.limits is None:
+            return self.get_one_hop_ids(node_id)
+        return self.get_frontiers(node_id, hop)[hop]
+
+    def get_frontiers(self, node_id, hop): # cached [frontier_0, ..., frontier_hop] of a single node
+        frontiers = self.hop_cache.get(node_id)
+        if frontiers is None or len(frontiers) <= hop:
+            frontiers = self.expand_frontiers([node_id], hop)
+            self.hop_cache[node_id] = frontiers
+            print('Finish finding neighbors of ', self.uris[node_id], 'hop =', hop)
+        return frontiers
+
+    def find_neighbor_ids_within(self, node_id, hop): # nodes at most `hop` hops away from node_id
+        assert hop >= 0, 'Hop number must be non-negative'
+        return np.unique(np.concatenate([self.find_neighbor_ids(node_id, h) for h in range(hop + 1)]))
+
+    def find_neighbors(self, uri, hop):
+        return set(self.get_uris(self.find_neighbor_ids(self.get_id(uri), hop)))
+
+    def find_neighbors_within(self, uri, hop):
+        return set(self.get_uris(self.find_neighbor_ids_within(self.get_id(uri), hop)))
+
+    def get_neighbor_ids_of_cluster(self, node_set, hop, relations=None, min_weight=None, report=None): # sorted ids of the nodes within `hop` hops of any node in node_set
+        for n in node_set:
+            assert n in self, "Invalid node " + n
+        frontiers = self.expand_frontiers([self.get_id(n) for n in node_set], hop, edge_mask=self.get_edge_mask(relations, min_weight), report=report)
+        return np.sort(np.concatenate(frontiers))
+
+    def get_neighbors_of_cluster(self, node_set, hop, relations=None, min_weight=None):
+        return set(self.get_uris(self.get_neighbor_ids_of_cluster(node_set, hop, relations, min_weight)))
+
+
+class ConceptNet_node_view:
+    # Drop-in for the per-node ConceptNet_node objects of the original dict graph (see benchmark.py), backed by a ConceptNet_graph
+
+    def __init__(self, graph, node_id):
+        self.graph = graph
+        self.node_id = node_id
+        self.uri = graph.uris[node_id]
+        self.label = self.uri[self.uri.rfind('/')+1:]
+
+    def find_neighbors(self, hop):
+        return set(self.graph.get_uris(self.graph.find_neighbor_ids(self.node_id, hop)))
+
+    def find_neighbors_within(self, hop):
+        return set(self.graph.get_uris(self.graph.find_neighbor_ids_within(self.node_id, hop)))
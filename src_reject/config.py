@@ -18,6 +18,13 @@ parser.add_argument("--fulltest", type=int, required=False, help="full test or n
 parser.add_argument("--threshold", type=float, required=False, help="threshold for seen")
 parser.add_argument("--nott", type=int, required=False, help="no. of original texts to be translated")
 parser.add_argument("--naug", type=int, default = 0, required=False, help="no. of augmented data per unseen class")
+parser.add_argument("--workers", type=int, default=1, required=False, help="no. of worker processes for kg vector generation, by default 1")
+parser.add_argument("--kgvocab", type=int, default=0, required=False, help="kg vector generation only for words in the dataset vocab or not, by default 0")
+parser.add_argument("--maxdegree", type=int, required=False, help="kg vector generation: max no. of edges followed from a hub node, by default no limit")
+parser.add_argument("--hubs", type=str, default="sample", required=False, help="kg vector generation: edges followed from a hub node: sample truncate skip, by default sample")
+parser.add_argument("--maxnodes", type=int, required=False, help="kg vector generation: max no. of nodes in the neighborhood of a class, by default no limit")
+parser.add_argument("--tokenizer", type=str, default="fast", required=False, help="preprocessing tokenizer: fast (str.split) nltk (tl.nlp.process_sentence) verify (fast, stops if it differs from nltk on a sample), by default fast")
+parser.add_argument("--feedids", type=int, default=1, required=False, help="feed the models word ids and look up the word embeddings in the graph (1) or feed the word embeddings (0), by default 1")
 args = parser.parse_args()
 print(args)
 
@@ -28,6 +35,7 @@ global_threshold_for_seen = args.threshold
 print("GPU percentage %s" % global_gpu_occupation)
 print("Training %s" % global_is_train)
 global_test_base_epoch = args.baseepoch
+global_feed_word_ids = bool(args.feedids)
 
 ##################################
 # default setting
@@ -88,6 +96,7 @@ kg_embedding_dim = 30 # kg_vector cluster 3group
 # prepro_min_word_count = 5 # wiki
 prepro_min_word_count = 100 # arxiv
 prepro_max_sentence_length = max_length
+prepro_tokenizer = args.tokenizer
 
 cstep_print = 100
 cstep_print_unseen = 50
@@ -114,6 +123,8 @@ pos_dict = {'JJ': 'a', 'JJR': 'a', 'JJS': 'a',
 word_embed_file_path = "../data/glove/glove.6B.200d.txt"
 word_embed_gensim_file_path = '../data/glove/glove.6B.200d.gensim.txt'
 conceptnet_path = "../data/conceptnet-assertions-en-5.6.0.csv"
+conceptnet_lemma_cache_dir = "../data/conceptnet_lemma_cache/"
+conceptnet_extract_dir = "../data/conceptnet_extract/"
 POS_OF_WORD_path = "../data/POS_OF_WORD.pickle"
 WORD_TOPIC_TRANSLATION_path = "../data/WORD_TOPIC_TRANSLATION.pickle"
 
@@ -183,14 +194,14 @@ zhang15_dbpedia_full_data_path = zhang15_dbpedia_dir + "full.csv"
 zhang15_dbpedia_full_augmented_path = zhang15_dbpedia_dir + "full_augmented.csv"
 
 zhang15_dbpedia_train_path = zhang15_dbpedia_dir + "train.csv"
-zhang15_dbpedia_train_processed_path = zhang15_dbpedia_dir + "processed_train_text.pkl"
+zhang15_dbpedia_train_processed_path = zhang15_dbpedia_dir + "processed_train_text/"
 
 zhang15_dbpedia_train_augmented_path = zhang15_dbpedia_dir + "train_augmented.csv"
 zhang15_dbpedia_train_augmented_aggregated_path = zhang15_dbpedia_dir + "train_augmented_aggregated.csv"
-zhang15_dbpedia_train_augmented_processed_path = zhang15_dbpedia_dir + "processed_train_augmented_text.pkl"
+zhang15_dbpedia_train_augmented_processed_path = zhang15_dbpedia_dir + "processed_train_augmented_text/"
 
 zhang15_dbpedia_test_path = zhang15_dbpedia_dir + "test.csv"
-zhang15_dbpedia_test_processed_path = zhang15_dbpedia_dir + "processed_test_text.pkl"
+zhang15_dbpedia_test_processed_path = zhang15_dbpedia_dir + "processed_test_text/"
 
 zhang15_dbpedia_vocab_path = zhang15_dbpedia_dir + "vocab.txt"
 
@@ -206,11 +217,10 @@ zhang15_dbpedia_class_random_group_path = zhang15_dbpedia_dir + "dbpedia_random_
 
 # zhang15_dbpedia_kg_vector_dir = zhang15_dbpedia_dir + "KG_VECTOR_3/"
 # zhang15_dbpedia_kg_vector_prefix = "KG_VECTORS_3_"
-zhang15_dbpedia_kg_vector_node_data_path = zhang15_dbpedia_dir + 'NODES_DATA.pickle'
+zhang15_dbpedia_kg_vector_node_data_path = zhang15_dbpedia_dir + 'NODES_DATA/'
 zhang15_dbpedia_kg_vector_dir = zhang15_dbpedia_dir + "KG_VECTOR_CLUSTER_3GROUP/"
 zhang15_dbpedia_kg_vector_prefix = "VECTORS_CLUSTER_3_"
-
-zhang15_dbpedia_word_embed_matrix_path = zhang15_dbpedia_dir + "word_embed_matrix.npz"
+zhang15_dbpedia_kg_vector_tensor_path = zhang15_dbpedia_kg_vector_dir + "VECTORS_CLUSTER_3_TENSOR.npy"
 
 ##################################
 
@@ -291,23 +301,22 @@ news20_class_random_group_path = news20_dir + "20news_random_group_%s.txt" % uns
 news20_full_data_path = news20_dir + "full.csv"
 
 news20_train_path = news20_dir + "train.csv"
-news20_train_processed_path = news20_dir + "processed_train_text.pkl"
+news20_train_processed_path = news20_dir + "processed_train_text/"
 
 news20_test_path = news20_dir + "test.csv"
-news20_test_processed_path = news20_dir + "processed_test_text.pkl"
+news20_test_processed_path = news20_dir + "processed_test_text/"
 
 news20_train_augmented_path = news20_dir + "train_augmented.csv"
 news20_train_augmented_aggregated_path = news20_dir + "train_augmented_aggregated.csv"
-news20_train_augmented_processed_path = news20_dir + "processed_train_augmented_text.pkl"
+news20_train_augmented_processed_path = news20_dir + "processed_train_augmented_text/"
 
 
 news20_vocab_path = news20_dir + "vocab.txt"
 
-news20_kg_vector_node_data_path = news20_dir + 'NODES_DATA.pickle'
+news20_kg_vector_node_data_path = news20_dir + 'NODES_DATA/'
 news20_kg_vector_dir = news20_dir + "KG_VECTOR_CLUSTER_3GROUP/"
 news20_kg_vector_prefix = "VECTORS_CLUSTER_3_"
-
-news20_word_embed_matrix_path = news20_dir + "word_embed_matrix.npz"
+news20_kg_vector_tensor_path = news20_kg_vector_dir + "VECTORS_CLUSTER_3_TENSOR.npy"
 
 # news20_class_cluster_path = news20_dir + "class_clusters_20news.pickle"
 
@@ -1,8 +1,13 @@
 
 import os
 import re
+import csv
 import pickle
+import codecs
 import random
+import hashlib
+import collections
+import multiprocessing
 import numpy as np
 import pandas as pd
 import tensorflow as tf
@@ -10,6 +15,10 @@ import tensorlayer as tl
 import progressbar
 
 import config
+import utils
+import artifact_cache
+import dataset_index
+from token_store import Token_store, Token_store_writer, Npy_appender
 
 
 START_ID = '<START_ID>'
@@ -17,6 +26,11 @@ END_ID = '<END_ID>'
 PAD_ID = '<PAD_ID>'
 UNK_ID = '<UNK_ID>'
 
+WORKER_VOCAB = None # vocab used by word_ids_of_chunk, set before the pool is forked
+
+# Version of the code building each kind of cached artifact (see artifact_cache), to bump when its output changes
+CACHE_VERSIONS = {'vocab': 1, 'processed_text': 1, 'glove_store': 1, 'kg_vector_tensor': 1, 'padded_ids': 1}
+
 def get_random_group(filename):
     random_group = list()
     with open(filename, "r") as f:
@@ -39,19 +53,187 @@ def check_df(filename):
     # df.to_csv(filename)
     return nan
 
-def preprocess(textlist):
+## Tokenizers
+# After re.sub(r'[\W_]+', ' ', text) only letters, digits and spaces are left, and the NLTK word tokenizer behind
+# tl.nlp.process_sentence reduces to lowercasing and splitting on whitespace, except for the few words it splits
+# as contractions. The 'fast' tokenizer does exactly that with str.split, the 'nltk' one calls process_sentence,
+# and 'verify' tokenizes like 'fast' but also compares a sample of each chunk with 'nltk' (see verify_tokenizer).
+
+TOKENIZERS = ('fast', 'nltk', 'verify')
+NON_WORD_RE = re.compile(r'[\W_]+')
+NLTK_SPLIT_WORDS = {'cannot': ['can', 'not'], 'gimme': ['gim', 'me'], 'gonna': ['gon', 'na'], 'gotta': ['got', 'ta'], 'lemme': ['lem', 'me'], 'wanna': ['wan', 'na']}
+TOKENIZER_VERIFY_SAMPLE = 100 # texts compared per chunk in 'verify' mode
+
+def tokenize_fast(text):
+    words = text.lower().split()
+    if not NLTK_SPLIT_WORDS.keys().isdisjoint(words):
+        words = [part for word in words for part in NLTK_SPLIT_WORDS.get(word, [word])]
+    return [START_ID] + words + [END_ID]
+
+def tokenize_nltk(text):
+    return tl.nlp.process_sentence(text, start_word=START_ID, end_word=END_ID)
+
+def preprocess_text(text, tokenizer=None):
+    tokenizer = tokenizer or config.prepro_tokenizer
+    assert tokenizer in TOKENIZERS, 'unknown tokenizer %s' % tokenizer
+    text = NON_WORD_RE.sub(' ', text)
+    if tokenizer == 'nltk':
+        return tokenize_nltk(text)
+    return tokenize_fast(text)
+
+def verify_tokenizer(textlist, sample_size=TOKENIZER_VERIFY_SAMPLE, seed=None):
+    # [(text, fast tokens, nltk tokens)] of the texts in a random sample of textlist tokenized differently
+    rng = random.Random(seed)
+    sample = rng.sample(range(len(textlist)), min(sample_size, len(textlist)))
+    mismatches = list()
+    for idx in sorted(sample):
+        fast_words = preprocess_text(textlist[idx], 'fast')
+        nltk_words = preprocess_text(textlist[idx], 'nltk')
+        if fast_words != nltk_words:
+            mismatches.append((textlist[idx], fast_words, nltk_words))
+    return mismatches
+
+def check_tokenizer(textlist):
+    # tokenizer 'verify': stop on the first sample of textlist in which the fast tokenizer differs from nltk
+    mismatches = verify_tokenizer(textlist)
+    if mismatches:
+        text, fast_words, nltk_words = mismatches[0]
+        raise Exception("fast tokenizer differs from nltk on %d of %d sampled texts, e.g. %r: %s != %s" % (len(mismatches), min(TOKENIZER_VERIFY_SAMPLE, len(textlist)), text[:200], fast_words, nltk_words))
+
+def preprocess_chunk(textlist, tokenizer=None):
+    tokenizer = tokenizer or config.prepro_tokenizer
+    if tokenizer == 'verify':
+        check_tokenizer(textlist)
+    return [preprocess_text(text, tokenizer) for text in textlist]
+
+def preprocess(textlist, tokenizer=None):
     print("Preprocessing ...")
+    tokenizer = tokenizer or config.prepro_tokenizer
+    if tokenizer == 'verify':
+        check_tokenizer(textlist)
     with progressbar.ProgressBar(max_value=len(textlist)) as bar:
         for idx, text in enumerate(textlist):
             # textlist[idx].replace(",", " ")
             # textlist[idx].replace(".", " ")
-            textlist[idx] = re.sub(r'[\W_]+', ' ', textlist[idx])
-            textlist[idx] = tl.nlp.process_sentence(textlist[idx], start_word=START_ID, end_word=END_ID)
+            textlist[idx] = preprocess_text(textlist[idx], tokenizer)
             # textlist[idx] = textlist[idx].split() # no empty string in the list
             bar.update(idx + 1)
 
     return textlist
 
+## Parallel preprocessing
+# The CSV is read in chunks of rows, and each chunk is tokenized in a pool worker, either to count words
+# (for the vocab) or to map words to ids. Chunks are handled in order, so the word counts are merged in
+# the order in which words first appear and the vocab file is the same as create_vocab_given_text's.
+# At most a few chunks per worker are in flight and word ids go straight to the Token_store on disk,
+# so memory does not grow with the number of rows.
+
+def get_csv_encoding(filename, prefix_size=1 << 24):
+    # utf-8, or latin-1 as the fallback of load_data_from_text_given_vocab, from the first prefix_size bytes only
+    # (reduce_text_chunks reads the file again as latin-1 if it turns out not to be utf-8 further on)
+    with open(filename, "rb") as f:
+        prefix = f.read(prefix_size)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False) # a character cut at the end is not an error
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def read_text_chunks(filename, column, chunk_size, encoding):
+    # the text columns are read as str: pandas infers the dtypes of each chunk on its own, so a chunk whose texts
+    # are all numbers would otherwise get int or float values
+    columns = [column] if type(column) == str else column
+    for df in pd.read_csv(filename, index_col=0, encoding=encoding, chunksize=chunk_size, dtype={c: str for c in columns}):
+        yield get_text_list(df, column)
+
+def count_words_of_chunk(textlist): # runs in a pool worker
+    word_counts = collections.Counter()
+    for words in preprocess_chunk(textlist):
+        word_counts.update(words)
+    return word_counts
+
+def word_ids_of_chunk(textlist): # runs in a pool worker
+    return [np.array([WORKER_VOCAB.word_to_id(word) for word in words], dtype=np.int32) for words in preprocess_chunk(textlist)]
+
+def map_text_chunks(func, filename, column, encoding, num_workers=None, chunk_size=10000):
+    # func applied to each chunk of texts in a pool, results in chunk order
+    # (pool.imap would read the whole CSV ahead of the workers, so chunks are submitted as results come back)
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    max_pending = 2 * num_workers
+    pending = collections.deque()
+    with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+        with progressbar.ProgressBar(max_value=progressbar.UnknownLength) as bar:
+            for idx, textlist in enumerate(read_text_chunks(filename, column, chunk_size, encoding)):
+                if len(pending) == max_pending:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(func, (textlist,)))
+                bar.update(idx + 1)
+            while pending:
+                yield pending.popleft().get()
+
+def reduce_text_chunks(consume, func, filename, column, num_workers=None, chunk_size=10000):
+    # consume(the results of map_text_chunks). A file that looked like utf-8 (see get_csv_encoding) but is not
+    # further on is consumed again from the start as latin-1, so consume has to start from scratch on each call.
+    encoding = get_csv_encoding(filename)
+    try:
+        return consume(map_text_chunks(func, filename, column, encoding, num_workers, chunk_size))
+    except UnicodeDecodeError:
+        if encoding != "utf-8":
+            raise
+        print("%s is not utf-8, reading it again as latin-1 ..." % filename)
+        return consume(map_text_chunks(func, filename, column, "latin-1", num_workers, chunk_size))
+
+def count_words_of_file(filename, column, num_workers=None, chunk_size=10000):
+    print("Counting words of %s ..." % filename)
+    def consume(results):
+        word_counts = collections.Counter()
+        for chunk_word_counts in results:
+            word_counts.update(chunk_word_counts)
+        return word_counts
+    return reduce_text_chunks(consume, count_words_of_chunk, filename, column, num_workers, chunk_size)
+
+def word_ids_of_file(filename, column, vocab, num_workers=None, chunk_size=10000):
+    # Token_store of the word ids of each text, as preprocess + sentence_word_to_id
+    global WORKER_VOCAB
+    print("Preprocessing %s ..." % filename)
+    WORKER_VOCAB = vocab
+    try:
+        arrays = reduce_text_chunks(lambda results: [array for chunk in results for array in chunk], word_ids_of_chunk, filename, column, num_workers, chunk_size)
+    finally:
+        WORKER_VOCAB = None
+    return Token_store.from_arrays(arrays)
+
+def write_word_ids_of_file(filename, column, vocab, store_dirname, num_workers=None, chunk_size=10000):
+    # word_ids_of_file streamed chunk by chunk into the Token_store directory store_dirname
+    global WORKER_VOCAB
+    print("Preprocessing %s ..." % filename)
+    WORKER_VOCAB = vocab
+    def consume(results):
+        with Token_store_writer(store_dirname) as writer:
+            for chunk in results:
+                writer.append(chunk)
+    try:
+        reduce_text_chunks(consume, word_ids_of_chunk, filename, column, num_workers, chunk_size)
+    finally:
+        WORKER_VOCAB = None
+    print("Processed data saved to %s" % store_dirname)
+    return Token_store.load(store_dirname)
+
+def process_text_file(filename, column, vocab, processed_file, num_workers=None):
+    # word ids of the texts of filename, saved to processed_file
+    if processed_file.endswith("/"):
+        return write_word_ids_of_file(filename, column, vocab, processed_file, num_workers)
+    full_text_list = word_ids_of_file(filename, column, vocab, num_workers)
+    save_processed_text(processed_file, full_text_list)
+    return full_text_list
+
+def create_vocab_given_word_counts(word_counts, vocab_path, min_word_count=config.prepro_min_word_count):
+    # tl.nlp.create_vocab counts with Counter.update over its input, so passing the merged counts as a single "sentence" gives the same vocab
+    tl.nlp.create_vocab([word_counts], word_counts_output_file=vocab_path, min_word_count=min_word_count)
+    vocab = tl.nlp.Vocabulary(vocab_path, start_word=START_ID, end_word=END_ID, unk_word=UNK_ID)
+    return vocab
+
 def create_vocab_given_text(textlist, vocab_path, min_word_count=config.prepro_min_word_count):
     # create dictionary
     tl.nlp.create_vocab(textlist, word_counts_output_file=vocab_path, min_word_count=min_word_count)
@@ -70,62 +252,167 @@ def sentence_word_to_id(textlist, vocab):
 #         kg_vector_list[idx] = new_kg_vector
 #     return np.array(kg_vector_list)
 
+## Cache inputs
+# (kind, version, sources, params) of each cached artifact, as taken by artifact_cache.is_valid / save_manifest
+
+def get_vocab_hash(vocab, vocab_size=None):
+    # hash of the first vocab_size words (by default all)
+    return utils.hash_of_string("\n".join(vocab.reverse_vocab[:vocab_size]) + "|%d|%d|%d" % (vocab.start_id, vocab.end_id, vocab.unk_id))
+
+def get_vocab_params(vocab, path=None):
+    # vocab params of an artifact built from the word ids of vocab. Given the path of an existing artifact
+    # built before the vocab was extended (see extend_vocabulary), only the words it was built with are compared,
+    # so it stays valid as long as their ids are unchanged.
+    vocab_size = get_vocab_size(vocab)
+    manifest = artifact_cache.load_manifest(path) if path is not None else None
+    if manifest is not None:
+        params = manifest.get('params', dict())
+        if 'vocab' in params and 'vocab_size' not in params: # recorded before vocabs could be extended
+            return {'vocab': get_vocab_hash(vocab)}
+        if params.get('vocab_size', vocab_size) < vocab_size:
+            vocab_size = params['vocab_size']
+    return {'vocab': get_vocab_hash(vocab, vocab_size), 'vocab_size': vocab_size}
+
+def get_vocab_cache_inputs(filename, column, min_word_count, extensions=()):
+    params = {'column': column, 'min_word_count': min_word_count}
+    if extensions:
+        params['extensions'] = list(extensions)
+    return 'vocab', CACHE_VERSIONS['vocab'], [filename] + [extension['filename'] for extension in extensions], params
+
+def get_processed_text_cache_inputs(filename, column, vocab, processed_file=None):
+    params = {'column': column}
+    params.update(get_vocab_params(vocab, processed_file))
+    return 'processed_text', CACHE_VERSIONS['processed_text'], [filename], params
+
+def processed_text_exists(processed_file):
+    # A processed file ending with "/" is a Token_store directory; a pickle cache of an older run
+    # (same name with .pkl) is converted to it on first use
+    if not processed_file.endswith("/"):
+        return os.path.exists(processed_file)
+    if Token_store.exists(processed_file):
+        return True
+    pkl_file = processed_file.rstrip("/") + ".pkl"
+    if os.path.exists(pkl_file):
+        print("Converting %s to %s" % (pkl_file, processed_file))
+        with open(pkl_file, 'rb') as f:
+            Token_store.from_lists(pickle.load(f)).save(processed_file)
+        return True
+    return False
+
+def load_processed_text(processed_file):
+    if processed_file.endswith("/"):
+        return Token_store.load(processed_file)
+    elif processed_file.endswith(".pkl"):
+        with open(processed_file, 'rb') as f:
+            return pickle.load(f)
+    else:
+        with open(processed_file, "r") as f:
+            return eval(f.read())
+
+def save_processed_text(processed_file, full_text_list): # full_text_list = Token_store or list of int lists
+    if processed_file.endswith("/"):
+        if not isinstance(full_text_list, Token_store):
+            full_text_list = Token_store.from_lists(full_text_list)
+        full_text_list.save(processed_file)
+    elif processed_file.endswith(".pkl"):
+        with open(processed_file, "wb") as f:
+            pickle.dump(list(full_text_list), f)
+    else:
+        with open(processed_file, "w") as f:
+            f.write(str(list(full_text_list)))
+    print("Processed data saved to %s" % processed_file)
+
 def get_text_list(df, column):
     if type(column) == str:
-        full_text_list = df[column].tolist()
+        # a missing value (NaN, e.g. an empty text) counting as ' '
+        full_text_list = df[column].where(df[column].map(type) == str, ' ').tolist()
     elif type(column) == list:
-        df["text"] = df[column].apply(
-            lambda x: ' '.join([item if type(item) == str else ' ' for item in x]), axis=1)
+        # columns joined with ' ', a missing or non-string value counting as ' '
+        columns = [df[c].where(df[c].map(type) == str, ' ') for c in column]
+        df["text"] = columns[0].str.cat(columns[1:], sep=' ') if len(columns) > 1 else columns[0]
         full_text_list = df["text"].tolist()
     else:
         raise Exception("column should be either a string or a list of string")
     return full_text_list
 
-def load_data(filename, vocab_file, processed_file, column, min_word_count=config.prepro_min_word_count, force_process=False):
+def load_data(filename, vocab_file, processed_file, column, min_word_count=config.prepro_min_word_count, num_workers=None, force_process=False):
     print("Loading data ...")
 
-    if not force_process and os.path.exists(processed_file) and os.path.exists(vocab_file):
-        print("Processed data found in local files. Loading ...")
-        if processed_file.endswith(".pkl"):
-            with open(processed_file, 'rb') as f:
-                full_text_list = pickle.load(f)
-        else:
-            with open(processed_file, "r") as f:
-                full_text_list = eval(f.read())
-        vocab = tl.nlp.Vocabulary(vocab_file, start_word=START_ID, end_word=END_ID, unk_word=UNK_ID)
-    else:
-        df = pd.read_csv(filename, index_col=0)
-
-        full_text_list = get_text_list(df, column)
-        full_text_list = preprocess(full_text_list)
-        vocab = create_vocab_given_text(full_text_list, vocab_path=vocab_file, min_word_count=min_word_count)
-        full_text_list = sentence_word_to_id(full_text_list, vocab)
-
-        if processed_file.endswith(".pkl"):
-            with open(processed_file, "wb") as f:
-                pickle.dump(full_text_list, f)
-        else:
-            with open(processed_file, "w") as f:
-                f.write(str(full_text_list))
-        print("Processed data saved to %s" % processed_file)
-
-    print("Data loaded: num of seqs %s" % len(full_text_list))
+    vocab = build_vocabulary_from_full_corpus(filename, vocab_file, column, min_word_count, num_workers, force_process)
+    full_text_list = load_data_from_text_given_vocab(filename, vocab, processed_file, column, num_workers, force_process)
     return full_text_list, vocab
 
-def build_vocabulary_from_full_corpus(filename, vocab_file, column, min_word_count=config.prepro_min_word_count, force_process=False):
-    if not force_process and os.path.exists(vocab_file):
+def build_vocabulary_from_full_corpus(filename, vocab_file, column, min_word_count=config.prepro_min_word_count, num_workers=None, force_process=False):
+    # a vocab extended since it was built (see extend_vocabulary) is kept as long as all its sources are unchanged
+    cache_inputs = get_vocab_cache_inputs(filename, column, min_word_count, get_vocab_extensions(vocab_file))
+    if not force_process and artifact_cache.is_valid(vocab_file, *cache_inputs):
         print("Load vocab from local file")
-        vocab = tl.nlp.Vocabulary(vocab_file, start_word=START_ID, end_word=END_ID, unk_word=UNK_ID)
+        vocab = load_vocab(vocab_file)
     else:
         print("Creating vocab ...")
-        df = pd.read_csv(filename, index_col=0)
-
-        full_text_list = get_text_list(df, column)
-        full_text_list = preprocess(full_text_list)
-        vocab = create_vocab_given_text(full_text_list, vocab_path=vocab_file, min_word_count=min_word_count)
+        word_counts = count_words_of_file(filename, column, num_workers)
+        vocab = create_vocab_given_word_counts(word_counts, vocab_path=vocab_file, min_word_count=min_word_count)
+        artifact_cache.save_manifest(vocab_file, *get_vocab_cache_inputs(filename, column, min_word_count))
         print("Vocab created and saved in %s" % vocab_file)
     return vocab
 
+def load_vocab(vocab_file):
+    return tl.nlp.Vocabulary(vocab_file, start_word=START_ID, end_word=END_ID, unk_word=UNK_ID)
+
+def get_vocab_size(vocab):
+    # the unk id is the last one of a created vocab, but not of an extended one
+    return len(vocab.reverse_vocab)
+
+## Vocab extension
+# New documents are added to a vocab by appending their new words to the vocab file, so that the new words
+# get ids after all the existing ones and the id of every existing word stays the same. Processed texts,
+# KG vector tensors and checkpoints built with the smaller vocab stay valid (see get_vocab_params); only the new
+# documents are tokenized, and only the rows of the new words are added to the KG vector tensors.
+# A word of the old documents that was unknown and is now in the vocab stays unk_id in their processed texts.
+
+def get_vocab_extensions(vocab_file):
+    manifest = artifact_cache.load_manifest(vocab_file)
+    if manifest is None:
+        return list()
+    return manifest.get('params', dict()).get('extensions', list())
+
+def extend_vocabulary(vocab_file, filename, column, min_word_count=config.prepro_min_word_count, num_workers=None):
+    # adds the words occurring at least min_word_count times in the documents of filename to the vocab of
+    # build_vocabulary_from_full_corpus saved in vocab_file
+    manifest = artifact_cache.load_manifest(vocab_file)
+    if manifest is None or manifest.get('kind') != 'vocab':
+        raise Exception("%s has no vocab manifest, build it with build_vocabulary_from_full_corpus first" % vocab_file)
+    vocab = load_vocab(vocab_file)
+    extensions = get_vocab_extensions(vocab_file)
+    if filename in manifest['sources']:
+        print("Vocab %s already contains the words of %s" % (vocab_file, filename))
+        return vocab
+
+    print("Extending vocab with %s ..." % filename)
+    word_counts = count_words_of_file(filename, column, num_workers)
+    new_words = [(word, count) for word, count in word_counts.items() if count >= min_word_count and word not in vocab.vocab]
+    new_words.sort(key=lambda x: x[1], reverse=True)
+
+    with open(vocab_file, "r") as f:
+        lines = [line for line in f.read().split("\n") if line.strip()]
+    # the words the Vocabulary appends after those of the file (e.g. unk) are written out so their ids stay the same
+    lines.extend("%s 0" % word for word in vocab.reverse_vocab[len(lines):])
+    lines.extend("%s %d" % (word, count) for word, count in new_words)
+    tmp_filename = "%s.%d.tmp" % (vocab_file, os.getpid())
+    with open(tmp_filename, "w") as f:
+        f.write("\n".join(lines))
+    os.replace(tmp_filename, vocab_file)
+
+    extended_vocab = load_vocab(vocab_file)
+    assert extended_vocab.reverse_vocab[:get_vocab_size(vocab)] == vocab.reverse_vocab
+    assert extended_vocab.unk_id == vocab.unk_id
+
+    base_filename = [source for source in manifest['sources'] if source not in [extension['filename'] for extension in extensions]][0]
+    extensions = extensions + [{'filename': filename, 'column': column, 'min_word_count': min_word_count, 'vocab_size': get_vocab_size(vocab)}]
+    artifact_cache.save_manifest(vocab_file, *get_vocab_cache_inputs(base_filename, manifest['params']['column'], manifest['params']['min_word_count'], extensions))
+    print("Vocab extended with %d words: size %d -> %d" % (len(new_words), get_vocab_size(vocab), get_vocab_size(extended_vocab)))
+    return extended_vocab
+
 def load_data_class(filename, column):
     try:
         df = pd.read_csv(filename, index_col=0)
@@ -140,36 +427,17 @@ def load_class_dict(class_file, class_code_column, class_name_column):
 
     return class_dict
 
-def load_data_from_text_given_vocab(filename, vocab, processed_file, column, force_process=False):
+def load_data_from_text_given_vocab(filename, vocab, processed_file, column, num_workers=None, force_process=False):
     print("Loading data given vocab ...")
 
-    if not force_process and os.path.exists(processed_file):
+    cache_inputs = get_processed_text_cache_inputs(filename, column, vocab, processed_file)
+    if not force_process and processed_text_exists(processed_file) and artifact_cache.is_valid(processed_file, *cache_inputs):
         print("Processed data found in local files. Loading ...")
-        if processed_file.endswith(".pkl"):
-            with open(processed_file, 'rb') as f:
-                full_text_list = pickle.load(f)
-        else:
-            with open(processed_file, "r") as f:
-                full_text_list = eval(f.read())
+        full_text_list = load_processed_text(processed_file)
 
     else:
-
-        try:
-            df = pd.read_csv(filename, index_col=0)
-        except:
-            df = pd.read_csv(filename, index_col=0, encoding="latin-1")
-
-        full_text_list = get_text_list(df, column)
-        full_text_list = preprocess(full_text_list)
-        full_text_list = sentence_word_to_id(full_text_list, vocab)
-
-        if processed_file.endswith(".pkl"):
-            with open(processed_file, "wb") as f:
-                pickle.dump(full_text_list, f)
-        else:
-            with open(processed_file, "w") as f:
-                f.write(str(full_text_list))
-        print("Processed data saved to %s" % processed_file)
+        full_text_list = process_text_file(filename, column, vocab, processed_file, num_workers)
+        artifact_cache.save_manifest(processed_file, *get_processed_text_cache_inputs(filename, column, vocab))
 
     print("Data loaded: num of seqs %s" % len(full_text_list))
     return full_text_list
@@ -192,11 +460,24 @@ def get_kg_vector(kg_vector_dict, class_label, word):
             return kg_vector_dict[class_label][word]
         return np.zeros(config.kg_embedding_dim)
 
+def get_kg_vector_filenames(filedir, fileprefix, class_dict):
+    return ["%s%s%s.pickle" % (filedir, fileprefix, class_dict[class_id]) for class_id in sorted(class_dict)]
+
+def check_kg_vector_vocab(filename):
+    # The KG vectors of a vocab-restricted run (kg_vector_generation.py --kgvocab 1) only cover the words of its vocab file,
+    # recorded in the manifest next to the pickle. Words added to the vocab since would silently get zero vectors.
+    manifest = artifact_cache.load_manifest(filename)
+    vocab_filename = manifest.get('params', dict()).get('vocab_filename') if manifest is not None else None
+    if vocab_filename is not None and not artifact_cache.source_matches(vocab_filename, manifest['sources'].get(vocab_filename)):
+        raise Exception("KG vectors %s were only computed for the words of %s, which has changed since. "
+                        "Run kg_vector_generation.py again." % (filename, vocab_filename))
+
 def load_kg_vector(filedir, fileprefix, class_dict):
     print("Loading KG_VECTOR ...")
     kg_vector_dict = dict()
     for class_id in class_dict:
 
+        check_kg_vector_vocab("%s%s%s.pickle" % (filedir, fileprefix, class_dict[class_id]))
         with open("%s%s%s.pickle" % (filedir, fileprefix, class_dict[class_id]), 'rb') as f:
             class_kg_dict = pickle.load(f)
 
@@ -211,57 +492,279 @@ def load_kg_vector(filedir, fileprefix, class_dict):
     print(kg_vector_dict.keys())
     return kg_vector_dict
 
-def load_kg_vector_given_text_seqs(text_seqs, vocab, class_dict, kg_vector_dict, processed_file, force_process=False):
-
+def load_kg_vector_given_text_seqs(text_seqs, vocab, class_dict, kg_vector_dict, processed_file=None, force_process=False, dtype=np.float32):
+    # KG_vector_seqs of text_seqs: the KG vectors of each text are gathered when it is accessed
+    # from a [num_classes, vocab_size, kg_embedding_dim] table, instead of being precomputed and pickled.
+    # The table is cached by load_kg_vector_tensor next to processed_file (the pickle of the precomputed
+    # vectors of older runs), keyed on the content of kg_vector_dict; without processed_file it is built in memory.
     print("Loading KG Vector ...")
-    if not force_process and os.path.exists(processed_file):
-        print("Processed data found in local files. Loading ...")
-        with open(processed_file, 'rb') as f:
-            kg_vector_seqs = pickle.load(f)
+    if processed_file is None:
+        kg_vector_tensor = build_kg_vector_tensor(kg_vector_dict, class_dict, vocab, dtype=dtype)
     else:
-        kg_vector_seqs = list()
-
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                kg_vector_text_dict = dict()
-                for class_id in class_dict:
-                    kg_vector = np.zeros([len(text), config.kg_embedding_dim])
-                    for widx, word_id in enumerate(text):
-                        kg_vector[widx, :] = get_kg_vector(kg_vector_dict, class_dict[class_id], vocab.id_to_word(word_id))
-                    kg_vector_text_dict[class_id] = kg_vector
-                kg_vector_seqs.append(kg_vector_text_dict)
-                bar.update(idx)
-        with open(processed_file, "wb") as f:
-            pickle.dump(kg_vector_seqs, f)
-    return kg_vector_seqs
-
-def load_glove_word_vector(filename, npzfilename, vocab, force_process=False):
+        kg_vector_tensor = load_kg_vector_tensor(None, None, class_dict, vocab, os.path.splitext(processed_file)[0] + "_TENSOR.npy",
+                                                 dtype=dtype, force_process=force_process, kg_vector_dict=kg_vector_dict)
+    return KG_vector_seqs(kg_vector_tensor, text_seqs, class_dict)
+
+class KG_vector_seqs:
+    # Indexable like the list of per-text dicts it replaces: seqs[idx][class_id] is the [len(text), kg_embedding_dim]
+    # array of KG vectors of the words of text idx given class class_id
+
+    def __init__(self, kg_vector_tensor, text_seqs, class_dict):
+        self.kg_vector_tensor = kg_vector_tensor
+        self.text_seqs = text_seqs
+        self.class_ids = sorted(class_dict)
+
+    def __len__(self):
+        return len(self.text_seqs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        text = np.asarray(self.text_seqs[idx], dtype=np.int64)
+        return {class_id: self.kg_vector_tensor[class_id - 1, text] for class_id in self.class_ids}
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def get_batch(self, idx_list, class_id_list):
+        # KG vectors of text idx_list[i] given class class_id_list[i], one array per text
+        return [self.kg_vector_tensor[class_id - 1, np.asarray(self.text_seqs[idx], dtype=np.int64)]
+                for idx, class_id in zip(idx_list, class_id_list)]
+
+def build_kg_vector_tensor(kg_vector_dict, class_dict, vocab, word_fn=None, dtype=np.float32, start_word_id=0):
+    # Converter from the per-class {uri: vector} pickles (see load_kg_vector) to a single
+    # [num_classes, vocab_size, kg_embedding_dim] array: tensor[class_id - 1, word_id] == get_kg_vector(kg_vector_dict, class_dict[class_id], word)
+    # word_fn maps each vocab word to the word looked up in ConceptNet (e.g. its lemma)
+    # Only the words from start_word_id on are converted, e.g. the new words of an extended vocab.
+    words = [vocab.id_to_word(word_id) for word_id in range(start_word_id, get_vocab_size(vocab))]
+    if word_fn is not None:
+        words = [word_fn(word) for word in words]
+
+    kg_vector_tensor = np.zeros((max(class_dict), len(words), config.kg_embedding_dim), dtype=dtype)
+    with progressbar.ProgressBar(max_value=len(class_dict)) as bar:
+        for idx, class_id in enumerate(sorted(class_dict)):
+            for word_id, word in enumerate(words):
+                kg_vector_tensor[class_id - 1, word_id, :] = get_kg_vector(kg_vector_dict, class_dict[class_id], word)
+            bar.update(idx + 1)
+    return kg_vector_tensor
+
+def get_kg_vector_dict_hash(kg_vector_dict):
+    # hash of the uris and vectors of each class of kg_vector_dict (see load_kg_vector)
+    sha1 = hashlib.sha1()
+    for class_name in sorted(kg_vector_dict):
+        uris = sorted(kg_vector_dict[class_name])
+        sha1.update(("%s|%s|" % (class_name, "\n".join(uris))).encode('utf8'))
+        for uri in uris:
+            sha1.update(np.asarray(kg_vector_dict[class_name][uri], dtype=np.float64).tobytes())
+    return sha1.hexdigest()
+
+def load_kg_vector_tensor(filedir, fileprefix, class_dict, vocab, npyfilename, word_fn=None, word_fn_params=None, dtype=np.float32, force_process=False, kg_vector_dict=None):
+    # word_fn_params: the settings that decide what word_fn maps a word to (e.g. {'lemma': True}), part of the cache key
+    # kg_vector_dict: the KG vectors already loaded, instead of the pickles in filedir; the cache is then keyed on their content
+    print("Loading KG_VECTOR tensor ...")
+    if word_fn is not None and word_fn_params is None:
+        raise ValueError("word_fn_params are needed to tell the tensors of different word_fn apart")
+    shape = (max(class_dict), get_vocab_size(vocab), config.kg_embedding_dim)
+    kg_vector_hash = get_kg_vector_dict_hash(kg_vector_dict) if kg_vector_dict is not None else None
+    def get_cache_inputs(path=None):
+        params = {'class_dict': class_dict, 'dtype': np.dtype(dtype).str, 'word_fn': word_fn_params if word_fn is not None else None}
+        params.update(get_vocab_params(vocab, path))
+        if kg_vector_dict is not None:
+            params['kg_vectors'] = kg_vector_hash
+            return 'kg_vector_tensor', CACHE_VERSIONS['kg_vector_tensor'], [], params
+        return 'kg_vector_tensor', CACHE_VERSIONS['kg_vector_tensor'], get_kg_vector_filenames(filedir, fileprefix, class_dict), params
+
+    kg_vector_tensor = None
+    if not force_process and artifact_cache.is_valid(npyfilename, *get_cache_inputs(npyfilename)):
+        kg_vector_tensor = np.load(npyfilename, mmap_mode='r')
+        if kg_vector_tensor.shape == shape and kg_vector_tensor.dtype == dtype:
+            print("KG_VECTOR tensor found in local file: %s %s" % (kg_vector_tensor.shape, kg_vector_tensor.dtype))
+            return kg_vector_tensor
+        if kg_vector_tensor.shape[0::2] != shape[0::2] or kg_vector_tensor.shape[1] > shape[1] or kg_vector_tensor.dtype != dtype:
+            print("KG_VECTOR tensor %s does not match classes and vocab %s, rebuilding ..." % (kg_vector_tensor.shape, shape))
+            kg_vector_tensor = None
+
+    if kg_vector_dict is None:
+        kg_vector_dict = load_kg_vector(filedir, fileprefix, class_dict)
+    if kg_vector_tensor is None:
+        kg_vector_tensor = build_kg_vector_tensor(kg_vector_dict, class_dict, vocab, word_fn=word_fn, dtype=dtype)
+    else: # built before the vocab was extended, only the rows of the new words are added
+        print("Extending KG_VECTOR tensor %s to vocab size %d ..." % (kg_vector_tensor.shape, shape[1]))
+        new_rows = build_kg_vector_tensor(kg_vector_dict, class_dict, vocab, word_fn=word_fn, dtype=dtype, start_word_id=kg_vector_tensor.shape[1])
+        kg_vector_tensor = np.concatenate([kg_vector_tensor, new_rows], axis=1)
+    tmp_filename = "%s.%d.tmp.npy" % (os.path.splitext(npyfilename)[0], os.getpid())
+    np.save(tmp_filename, kg_vector_tensor)
+    os.replace(tmp_filename, npyfilename)
+    artifact_cache.save_manifest(npyfilename, *get_cache_inputs())
+    print("KG_VECTOR tensor saved to %s: %s %s" % (npyfilename, kg_vector_tensor.shape, kg_vector_tensor.dtype))
+    return np.load(npyfilename, mmap_mode='r')
+
+def get_kg_vector_seqs(kg_vector_tensor, class_id_list, text_seqs):
+    # [batch_size, max_length, kg_embedding_dim] KG vectors of text_seqs (padded word ids) given the class of each text
+    class_id_list = np.asarray(class_id_list)
+    return kg_vector_tensor[class_id_list[:, np.newaxis] - 1, np.asarray(text_seqs)]
+
+## Padded word ids
+# Each text as the controllers feed it: text[startid:-1] (startid 1, i.e. without the start and end ids) cut to
+# max_length - 1 ids and padded with pad_id to max_length, the last column always pad_id. This is what
+# prepro_encode got from tl.prepro.pad_sequences followed by replacing the last id with pad_id.
+
+def get_padded_ids(textlist, max_length, pad_id, startid_list=None):
+    padded_ids = np.full((len(textlist), max_length), pad_id, dtype=np.int32)
+    for idx, text in enumerate(textlist):
+        startid = 1 if startid_list is None else startid_list[idx]
+        text = text[startid:-1][:max_length - 1]
+        padded_ids[idx, :len(text)] = text
+    return padded_ids
+
+def build_padded_id_matrix(token_store, max_length, pad_id, out=None, chunk_size=1 << 16):
+    # get_padded_ids of all texts of token_store, gathered straight from its token array
+    num_seqs = len(token_store)
+    if out is None:
+        out = np.empty((num_seqs, max_length), dtype=np.int32)
+    offsets = np.asarray(token_store.offsets)
+    columns = np.arange(max_length - 1)
+    for start in range(0, num_seqs, chunk_size):
+        end = min(start + chunk_size, num_seqs)
+        lengths = np.clip(offsets[start + 1:end + 1] - offsets[start:end] - 2, 0, max_length - 1)
+        mask = columns[np.newaxis, :] < lengths[:, np.newaxis]
+        chunk = np.full((end - start, max_length), pad_id, dtype=np.int32)
+        chunk[:, :-1][mask] = token_store.tokens[(offsets[start:end, np.newaxis] + 1 + columns[np.newaxis, :])[mask]]
+        out[start:end] = chunk
+    return out
+
+def get_padded_id_matrix(text_seqs, max_length, pad_id, force_process=False):
+    # [len(text_seqs), max_length] int32 padded ids of text_seqs, whose rows (or row slices) are the batches.
+    # Saved next to a Token_store loaded from disk once per max_length and loaded memory-mapped;
+    # a Text_subset gets the rows of the matrices of its bases.
+    # Other bases (plain lists of a processed .pkl or .txt file, or in-memory Token_stores) are not cached and are
+    # padded again on every call: a content key for them costs more than the padding. The processed text of the
+    # datasets, augmented texts included, is a Token_store directory (config *_processed_path ending with "/").
+    if isinstance(text_seqs, dataset_index.Text_subset):
+        matrices = [get_padded_id_matrix(base, max_length, pad_id, force_process) for base in text_seqs.bases]
+        return dataset_index.Row_subset(matrices, text_seqs.base_offsets, text_seqs.positions)
+    if not isinstance(text_seqs, Token_store):
+        return get_padded_ids(text_seqs, max_length, pad_id)
+    if text_seqs.dirname is None:
+        return build_padded_id_matrix(text_seqs, max_length, pad_id)
+
+    npyfilename = os.path.join(text_seqs.dirname, "padded_ids_%d.npy" % max_length)
+    cache_inputs = ('padded_ids', CACHE_VERSIONS['padded_ids'],
+                    [os.path.join(text_seqs.dirname, name) for name in ['tokens.npy', 'offsets.npy']],
+                    {'max_length': max_length, 'pad_id': pad_id})
+    if force_process or not artifact_cache.is_valid(npyfilename, *cache_inputs):
+        print("Padding %s to %d ids ..." % (text_seqs.dirname, max_length))
+        tmp_filename = "%s.%d.tmp.npy" % (os.path.splitext(npyfilename)[0], os.getpid())
+        out = np.lib.format.open_memmap(tmp_filename, mode="w+", dtype=np.int32, shape=(len(text_seqs), max_length))
+        build_padded_id_matrix(text_seqs, max_length, pad_id, out)
+        out.flush()
+        del out
+        os.replace(tmp_filename, npyfilename)
+        artifact_cache.save_manifest(npyfilename, *cache_inputs)
+    return np.load(npyfilename, mmap_mode="r")
+
+## Batch encoding
+# The word ids and word embeddings fed to the models for each batch of padded ids. The embeddings are gathered
+# with a single np.take into a float32 buffer allocated once and reused by every batch, so the arrays
+# returned are only valid until the next batch is encoded.
+
+class Batch_encoder:
+
+    def __init__(self, word_embed_mat):
+        self.word_embed_mat = np.ascontiguousarray(word_embed_mat, dtype=np.float32)
+        self.ids = np.zeros((0, 0), dtype=np.int64)
+        self.embeddings = np.zeros((0, 0, self.word_embed_mat.shape[1]), dtype=np.float32)
+
+    def reserve(self, batch_size, max_length):
+        if batch_size > self.ids.shape[0] or max_length != self.ids.shape[1]:
+            self.ids = np.empty((batch_size, max_length), dtype=np.int64)
+            self.embeddings = np.empty((batch_size, max_length, self.word_embed_mat.shape[1]), dtype=np.float32)
+
+    def encode(self, padded_ids, with_embeddings=True):
+        # (int64 [batch_size, max_length] word ids, float32 [batch_size, max_length, word_embedding_dim] word embeddings or None)
+        padded_ids = np.asarray(padded_ids)
+        batch_size, max_length = padded_ids.shape
+        self.reserve(batch_size, max_length)
+        ids = self.ids[:batch_size]
+        ids[...] = padded_ids
+        if ids.size and (ids.min() < 0 or ids.max() >= self.word_embed_mat.shape[0]): # mode='clip' below does not check
+            raise IndexError("word id out of range of the embedding matrix %s" % (self.word_embed_mat.shape,))
+        if not with_embeddings:
+            return ids, None
+        embeddings = self.embeddings[:batch_size]
+        np.take(self.word_embed_mat, ids, axis=0, out=embeddings, mode='clip')
+        return ids, embeddings
+
+## GloVe store
+# The GloVe text file is converted once into a directory shared by all datasets: vectors.npy, a float32
+# matrix loaded memory-mapped, and words.txt, the word of each row. words.txt is written last.
+
+def get_glove_store_dirname(filename):
+    return os.path.splitext(filename)[0] + "/"
+
+def read_glove_chunks(filename, chunk_size=50000):
+    # (words, float32 vectors) of each chunk of lines of the GloVe text file
+    with open(filename, "r", encoding="utf8") as f:
+        dim = len(f.readline().rstrip("\n").split(" ")) - 1
+    dtype = {0: str}
+    dtype.update({col: np.float32 for col in range(1, dim + 1)})
+    reader = pd.read_csv(filename, sep=" ", header=None, index_col=False, dtype=dtype, quoting=csv.QUOTE_NONE,
+                         na_filter=False, encoding="utf8", float_precision="round_trip", chunksize=chunk_size)
+    for df in reader:
+        yield df[0].tolist(), df.iloc[:, 1:].values.astype(np.float32)
+
+def convert_glove_word_vector(filename, store_dirname):
+    print("Converting %s to %s ..." % (filename, store_dirname))
+    os.makedirs(store_dirname, exist_ok=True)
+    words_filename = os.path.join(store_dirname, "words.txt")
+    if os.path.exists(words_filename):
+        os.remove(words_filename)
+    words = list()
+    vectors = None
+    with progressbar.ProgressBar(max_value=progressbar.UnknownLength) as bar:
+        for chunk_words, chunk_vectors in read_glove_chunks(filename):
+            if vectors is None:
+                vectors = Npy_appender(os.path.join(store_dirname, "vectors.%d.tmp.npy" % os.getpid()), np.float32, chunk_vectors.shape[1:])
+            vectors.append(chunk_vectors)
+            words.extend(chunk_words)
+            bar.update(len(words))
+    vectors.close()
+    os.replace(vectors.filename, os.path.join(store_dirname, "vectors.npy"))
+    tmp_filename = words_filename + ".%d.tmp" % os.getpid()
+    with open(tmp_filename, "w", encoding="utf8") as f:
+        f.write("\n".join(words))
+    os.replace(tmp_filename, words_filename)
+
+def load_glove_store(filename, force_process=False):
+    # words, vectors of the GloVe text file filename, converted on first use
+    store_dirname = get_glove_store_dirname(filename)
+    cache_inputs = ('glove_store', CACHE_VERSIONS['glove_store'], [filename], None)
+    if force_process or not os.path.exists(os.path.join(store_dirname, "words.txt")) or not artifact_cache.is_valid(store_dirname, *cache_inputs):
+        convert_glove_word_vector(filename, store_dirname)
+        artifact_cache.save_manifest(store_dirname, *cache_inputs)
+    with open(os.path.join(store_dirname, "words.txt"), "r", encoding="utf8") as f:
+        words = f.read().split("\n")
+    vectors = np.load(os.path.join(store_dirname, "vectors.npy"), mmap_mode="r")
+    assert len(words) == vectors.shape[0]
+    return words, vectors
+
+def load_glove_word_vector(filename, vocab, force_process=False):
+    # row word_id = GloVe vector of the word, zero for words without one and for unk
     print("Glove loading ... ")
+    words, vectors = load_glove_store(filename, force_process)
+    glove_index = dict(zip(words, range(len(words))))
 
-    if not force_process and os.path.exists(npzfilename):
-        print("Glove found in local file")
-        glove_mat = np.load(npzfilename)["matrix"]
-        print("Glove loaded: mat %s, vocab size %d" % (glove_mat.shape, np.count_nonzero(np.sum(glove_mat, axis=1))))
-
-    else:
-        glove_mat = np.zeros((vocab.unk_id + 1, config.word_embedding_dim))
-
-        num = 0
-        with progressbar.ProgressBar(max_value=400000) as bar:
-            with open(filename, 'r') as f:
-                for idx, line in enumerate(f):
-                    content = line.replace("\n", "").split(" ")
-
-                    word = content[0]
-                    vect = np.array(content[1:]).astype(np.float32)
+    word_ids, glove_ids = list(), list()
+    for word, word_id in vocab.vocab.items():
+        if word_id != vocab.unk_id and word in glove_index:
+            word_ids.append(word_id)
+            glove_ids.append(glove_index[word])
 
-                    word_id = vocab.word_to_id(word)
-                    if word_id != vocab.unk_id:
-                        glove_mat[word_id, : ] = vect
-                        num += 1
-                    bar.update(idx + 1)
-            np.savez(npzfilename, matrix=glove_mat)
-        print("Glove loaded: mat %s, vocab size %d" % (glove_mat.shape, num))
+    glove_mat = np.zeros((get_vocab_size(vocab), vectors.shape[1]), dtype=np.float32)
+    order = np.argsort(glove_ids) # gather rows of the memory-mapped matrix in file order
+    glove_mat[np.array(word_ids, dtype=np.int64)[order]] = vectors[np.array(glove_ids, dtype=np.int64)[order]]
+    print("Glove loaded: mat %s, vocab size %d" % (glove_mat.shape, len(word_ids)))
 
     return glove_mat
 
@@ -316,7 +819,7 @@ if __name__ == "__main__":
     )
 
     glove_mat = load_glove_word_vector(
-        config.word_embed_file_path, config.chen14_word_embed_matrix_path, vocab
+        config.word_embed_file_path, vocab
     )
 
     class_dict = load_class_dict(
@@ -0,0 +1,130 @@
+import numpy as np
+
+import utils
+
+## Class-partitioned dataset index
+# The positions of the documents of each class, so that a seen/unseen or one-vs-rest split is a
+# concatenation of position arrays, and the split texts a Text_subset view instead of a copied list.
+
+class Class_index:
+
+    def __init__(self, positions, num_docs):
+        self.positions = positions # class_id -> sorted int32 array of the positions of its documents
+        self.num_docs = num_docs
+
+    @staticmethod
+    def from_class_list(class_list):
+        class_array = np.asarray(class_list)
+        order = np.argsort(class_array, kind='stable').astype(np.int32)
+        class_ids, starts = np.unique(class_array[order], return_index=True)
+        ends = np.append(starts[1:], order.shape[0])
+        positions = {class_id.item(): order[start:end] for class_id, start, end in zip(class_ids, starts, ends)}
+        return Class_index(positions, class_array.shape[0])
+
+    def get_class_ids(self):
+        return sorted(self.positions)
+
+    def get_count(self, class_id):
+        return self.positions[class_id].shape[0] if class_id in self.positions else 0
+
+    def get_positions(self, class_ids, max_per_class=None):
+        # sorted positions of the documents of any of class_ids, i.e. in dataset order
+        # (only the first max_per_class documents of each class if given)
+        arrays = [self.positions[class_id][:max_per_class] for class_id in class_ids if class_id in self.positions]
+        if not arrays:
+            return np.zeros(0, dtype=np.int32)
+        return np.sort(np.concatenate(arrays))
+
+    def get_positions_except(self, class_ids):
+        class_ids = set(class_ids)
+        return self.get_positions([class_id for class_id in self.positions if class_id not in class_ids])
+
+CLASS_INDEX_CACHE = dict() # hash of the class ids -> Class_index, without holding on to the class lists
+
+def get_class_index(class_list):
+    # Class_index of class_list, built once per distinct list of class ids
+    class_array = np.asarray(class_list)
+    key = utils.hash_of_array(class_array)
+    if key not in CLASS_INDEX_CACHE:
+        CLASS_INDEX_CACHE[key] = Class_index.from_class_list(class_array)
+    return CLASS_INDEX_CACHE[key]
+
+def select_classes(class_list, positions):
+    return np.asarray(class_list)[positions].tolist()
+
+
+class Text_subset:
+    # The texts at positions of one or more text_seqs (positions count through bases back to back),
+    # indexable like a list of texts without copying them
+
+    def __init__(self, bases, positions):
+        self.bases = bases
+        self.base_offsets = np.cumsum([0] + [len(base) for base in bases])
+        self.positions = np.asarray(positions, dtype=np.int64)
+
+    @staticmethod
+    def select(text_seqs, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        if isinstance(text_seqs, Text_subset): # a subset of a subset indexes the original texts
+            return Text_subset(text_seqs.bases, text_seqs.positions[positions])
+        return Text_subset([text_seqs], positions)
+
+    @staticmethod
+    def concat(subsets):
+        bases = list()
+        positions = list()
+        offset = 0
+        for subset in subsets:
+            if not isinstance(subset, Text_subset):
+                subset = Text_subset.select(subset, np.arange(len(subset)))
+            positions.append(subset.positions + offset)
+            bases.extend(subset.bases)
+            offset += sum(len(base) for base in subset.bases)
+        return Text_subset(bases, np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return self.positions.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        position = self.positions[idx]
+        if len(self.bases) == 1:
+            return self.bases[0][position]
+        base_idx = np.searchsorted(self.base_offsets, position, side='right') - 1
+        return self.bases[base_idx][position - self.base_offsets[base_idx]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __add__(self, other): # like list concatenation
+        return Text_subset.concat([self, other])
+
+    def __radd__(self, other):
+        return Text_subset.concat([other, self])
+
+
+class Row_subset:
+    # Rows at positions of one or more row arrays (e.g. the padded id matrices of the bases of a Text_subset),
+    # row-indexable like the array of those rows without gathering them up front
+
+    def __init__(self, matrices, base_offsets, positions):
+        self.matrices = matrices
+        self.base_offsets = base_offsets
+        self.positions = positions
+        self.shape = (positions.shape[0],) + matrices[0].shape[1:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        positions = self.positions[idx]
+        if len(self.matrices) == 1:
+            return np.asarray(self.matrices[0][positions])
+        base_ids = np.searchsorted(self.base_offsets, positions, side='right') - 1
+        rows = np.empty(np.shape(positions) + self.shape[1:], dtype=self.matrices[0].dtype)
+        for base_idx, matrix in enumerate(self.matrices):
+            mask = base_ids == base_idx
+            rows[mask] = matrix[positions[mask] - self.base_offsets[base_idx]]
+        return rows
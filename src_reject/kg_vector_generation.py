@@ -1,4 +1,5 @@
 import pickle, json, requests, csv, copy, os, re
+import multiprocessing
 import numpy as np
 import pprint as pp
 import urllib.request, urllib.parse
@@ -13,6 +14,9 @@ from nltk.stem import WordNetLemmatizer
 from tqdm import tqdm
 
 import config
+import utils
+import artifact_cache
+from conceptnet_graph import ConceptNet_graph, String_table, Expansion_limits
 
 ## Global variables initialisation
 
@@ -25,7 +29,19 @@ pos_dict = {'JJ': 'a', 'JJR': 'a', 'JJS': 'a',
            'VB': 'v', 'VBD': 'v', 'VBG': 'v', 'VBN': 'v', 'VBP': 'v', 'VBZ': 'v'}
 
 NODES_DATA = dict()
+ALL_NODES_DATA = None # graph of every relation with relation and weight columns, NODES_DATA is its subgraph for the chosen relations
+VOCAB_NODE_IDS = None # sorted node ids kept by a vocab-restricted run, see get_vocab_node_ids
 lemmatise_dict = dict()
+lemmatise_label_dict = dict()
+
+WEIGHT_RE = re.compile(r'"weight":\s*([0-9.eE+-]+)')
+
+# Edges used for the KG vectors by default
+REL_LIST = ['/r/IsA', '/r/PartOf', '/r/AtLocation', '/r/RelatedTo']
+MIN_WEIGHT = 1.0
+
+# Version of the KG vector pickles, recorded in their manifests (see save_kg_vector_manifests)
+KG_VECTORS_VERSION = 1
 
 
 ## Functions
@@ -80,51 +96,18 @@ def get_class_info(filename):
 
 def get_all_nodes_from_label(label):
     ans = []
-    if standardized_uri('en', label) in NODES_DATA:
-        ans.append(standardized_uri('en', label))
+    uri = standardized_uri('en', label)
+    if uri in NODES_DATA:
+        ans.append(uri)
     for token in label.split():
         if token not in stop_words:
-            token = lemmatise_ConceptNet_label(token)
-            if standardized_uri('en', token) in NODES_DATA and standardized_uri('en', token) not in ans:
-                ans.append(standardized_uri('en', token))
+            uri = standardized_uri('en', lemmatise_ConceptNet_label(token))
+            if uri in NODES_DATA and uri not in ans:
+                ans.append(uri)
     return ans
 
 ### ConceptNet (nodes) related functions
 
-class ConceptNet_node:
-    
-    def __init__(self, uri): # Create a node
-        self.uri = remove_word_sense(uri)
-        self.label = uri[uri.rfind('/')+1:]
-        self.neighbors = {0: set([self.uri]),
-                          1: set()}
-        
-    def find_neighbors(self, hop):
-        if hop not in self.neighbors:
-            one_hop_less = self.find_neighbors(hop-1)
-            ans = set()
-            for n in one_hop_less:
-                ans = ans.union(NODES_DATA[n].find_neighbors(1))
-            ans = ans.difference(self.find_neighbors_within(hop-1))
-            self.neighbors[hop] = ans
-            print('Finish finding neighbors of ', self.uri, 'hop =', hop)
-        return self.neighbors[hop]
-    
-    def find_neighbors_within(self, hop):
-        assert hop >= 0, 'Hop number must be non-negative'
-        if hop == 0:
-            return self.neighbors[0]
-        else:
-            return self.find_neighbors(hop).union(self.find_neighbors_within(hop-1))
-
-
-def get_neighbors_of_cluster(node_set, hop):
-    ans = set()
-    for n in node_set:
-        assert n in NODES_DATA, "Invalid node " + n
-        ans = ans.union(NODES_DATA[n].find_neighbors_within(hop))
-    return ans
-
 def remove_word_sense(sub):
     if sub.count('/') > 3:
         if sub.count('/') > 4:
@@ -138,6 +121,8 @@ def get_label_from_uri(uri):
     return uri[uri.rfind('/')+1:]
 
 def lemmatise_ConceptNet_label(label):
+    if label in lemmatise_label_dict:
+        return lemmatise_label_dict[label]
     if '_' in label:
         return label
     else:
@@ -148,100 +133,393 @@ def lemmatise_ConceptNet_label(label):
             return lemmatizer.lemmatize(label, pos_dict[tag])
 
 def lemmatise_ConceptNet_uri(uri):
+    if uri in lemmatise_dict:
+        return lemmatise_dict[uri]
     label = get_label_from_uri(uri)
     lemmatised_label = lemmatise_ConceptNet_label(label)
     return standardized_uri('en', lemmatised_label)
 
-def create_lemmatised_dict(ns): # ns is a set of nodes from read_all_nodes()
-    nodes = dict()
-    for n in tqdm(ns):
-        nodes[n] = lemmatise_ConceptNet_uri(n)
-    return nodes
+def lemmatise_ConceptNet_labels(labels): # batch version of lemmatise_ConceptNet_label + standardized_uri, runs in a pool worker
+    single_words = [label for label in labels if '_' not in label]
+    tags = dict(zip(single_words, [sent[0][1] for sent in nltk.pos_tag_sents([[label] for label in single_words])]))
+    lemmatised_labels = list()
+    for label in labels:
+        if label not in tags or tags[label] not in pos_dict:
+            lemmatised_labels.append(label)
+        else:
+            lemmatised_labels.append(lemmatizer.lemmatize(label, pos_dict[tags[label]]))
+    return list(zip(labels, lemmatised_labels, standardized_uris('en', lemmatised_labels)))
+
+def get_lemma_cache_filename(conceptnet_filename):
+    # The lemmas depend on the ConceptNet dump and on the NLTK tagger/lemmatizer
+    key = "%s|nltk-%s" % (utils.file_fingerprint(conceptnet_filename), nltk.__version__)
+    return os.path.join(config.conceptnet_lemma_cache_dir, "lemmas_%s.npz" % utils.hash_of_string(key)[:16]), key
+
+def save_lemma_cache(filename, key, rows): # rows = sorted (label, lemmatised label, lemmatised uri)
+    utils.make_dirlist([os.path.dirname(filename)])
+    tables = [String_table.from_strings([row[col] for row in rows]) for col in range(3)]
+    tmp_filename = "%s.%d.tmp.npz" % (filename[:-len(".npz")], os.getpid())
+    np.savez(tmp_filename, key=np.array(key),
+             labels_data=tables[0].data, labels_offsets=tables[0].offsets,
+             lemma_labels_data=tables[1].data, lemma_labels_offsets=tables[1].offsets,
+             lemma_uris_data=tables[2].data, lemma_uris_offsets=tables[2].offsets)
+    os.replace(tmp_filename, filename)
+
+def load_lemma_cache(filename, key):
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename) as npz:
+        if str(npz['key']) != key:
+            return None
+        tables = [String_table(npz[name + '_data'], npz[name + '_offsets']) for name in ['labels', 'lemma_labels', 'lemma_uris']]
+    return list(zip(*tables))
+
+def create_lemmatised_dict(ns, conceptnet_filename=None, num_workers=None, batch_size=10000): # ns = english nodes from read_ConceptNet
+    global lemmatise_label_dict
+    labels = sorted(set(get_label_from_uri(n) for n in ns))
+
+    rows = None
+    if conceptnet_filename is not None:
+        cache_filename, key = get_lemma_cache_filename(conceptnet_filename)
+        rows = load_lemma_cache(cache_filename, key)
+        if rows is not None and len(rows) == len(labels) and all(row[0] == label for row, label in zip(rows, labels)):
+            print("Lemmas found in local file %s" % cache_filename)
+        else:
+            rows = None
+
+    if rows is None:
+        batches = [labels[i:i + batch_size] for i in range(0, len(labels), batch_size)]
+        rows = list()
+        with multiprocessing.Pool(num_workers) as pool:
+            for batch_rows in tqdm(pool.imap(lemmatise_ConceptNet_labels, batches), total=len(batches)):
+                rows.extend(batch_rows)
+        if conceptnet_filename is not None:
+            save_lemma_cache(cache_filename, key, rows)
+            print("Lemmas saved to %s" % cache_filename)
+
+    lemmatise_label_dict = {label: lemmatised_label for label, lemmatised_label, _ in rows}
+    lemma_uri_of_label = {label: lemmatised_uri for label, _, lemmatised_uri in rows}
+    return {n: lemma_uri_of_label[get_label_from_uri(n)] for n in ns}
 
 ### Loading ConceptNet functions
 
-def read_all_nodes(filename): # get all distinct uri in conceptnet (without part of speech)
+def get_weight_of_edge(details): # details = the json column of an assertion
+    match = WEIGHT_RE.search(details)
+    if match is None:
+        return json.loads(details)['weight']
+    return float(match.group(1))
+
+def split_file_into_chunks(filename, num_chunks): # byte ranges [start, end) of roughly equal size
+    size = os.path.getsize(filename)
+    chunk_size = max(size // num_chunks + 1, 1)
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+def read_ConceptNet_chunk(args):
+    # A line belongs to the chunk in which it starts
+    filename, start, end, rel_list, min_weight = args
     nodes = set()
-    with open(filename, 'r', encoding = "utf8") as csvfile:
-        reader = csv.reader(csvfile, delimiter='\t')
-        for line in tqdm(reader):
+    edges = list()
+    with open(filename, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line = line.decode('utf8').rstrip('\r\n').split('\t')
+            if len(line) < 5:
+                continue
             if not line[2].startswith('/c/en/') or not line[3].startswith('/c/en/'): # only relationships with english nodes
                 continue
             sub = remove_word_sense(line[2])
             obj = remove_word_sense(line[3])
             nodes.add(sub)
             nodes.add(obj)
-    return nodes
-
-
-def load_one_hop_data(filename, NODES_DATA, rel_list):
-    count_edges = 0
-    with open(filename, 'r', encoding = "utf8") as csvfile:
-        reader = csv.reader(csvfile, delimiter='\t')
-        for line in tqdm(reader):
             rel = line[1].strip()
             if rel_list is None or rel in rel_list:
-                details = json.loads(line[4])
-                w = details['weight']
-                if w < 1.0:
+                weight = get_weight_of_edge(line[4])
+                if weight < min_weight:
                     continue
-                if not line[2].startswith('/c/en/') or not line[3].startswith('/c/en/'): # only relationships with english nodes
-                    continue
-                sub = lemmatise_dict[remove_word_sense(line[2])]
-                obj = lemmatise_dict[remove_word_sense(line[3])]
-                if sub != obj:
-                    NODES_DATA[sub].neighbors[1].add(obj)
-                    NODES_DATA[obj].neighbors[1].add(sub)
-                    count_edges += 1
-    print("Total no. of registered edges =", count_edges)
-
-
-def load_ConceptNet():
-    global lemmatise_dict, NODES_DATA
+                edges.append((sub, obj, rel, weight))
+    return nodes, edges
+
+def read_ConceptNet(filename, rel_list, num_workers=None, min_weight=1.0):
+    # Single pass over ConceptNet: all english nodes (word senses removed) and the edges between them of rel_list
+    # with weight >= min_weight, as (sub, obj, rel, weight) tuples
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    chunks = split_file_into_chunks(filename, num_workers * 4)
+    nodes = set()
+    edges = list()
+    with multiprocessing.Pool(num_workers) as pool:
+        for chunk_nodes, chunk_edges in tqdm(pool.imap_unordered(read_ConceptNet_chunk, [(filename, start, end, rel_list, min_weight) for start, end in chunks]), total=len(chunks)):
+            nodes.update(chunk_nodes)
+            edges.extend(chunk_edges)
+    return nodes, edges
+
+### ConceptNet extract
+# The edges kept by read_ConceptNet, saved once so that later runs do not parse the CSV again.
+# A directory of .npy files plus manifest.json (written last):
+#   nodes_data, nodes_offsets     String_table of all english nodes (word senses removed)
+#   sub, obj                      int32 node ids of each edge
+#   relation                      uint8 index into manifest['relation_names']
+#   weight                        float16
+# The manifest records the source fingerprint and the filter parameters the extract was made with.
+
+def get_ConceptNet_extract_manifest(conceptnet_filename, rel_list, min_weight):
+    return {'format': 'conceptnet_extract/1',
+            'source': os.path.basename(conceptnet_filename),
+            'source_fingerprint': utils.file_fingerprint(conceptnet_filename) if os.path.exists(conceptnet_filename) else None,
+            'language': 'en',
+            'relations': sorted(rel_list) if rel_list is not None else None,
+            'min_weight': min_weight,
+           }
+
+def get_ConceptNet_extract_dirname(manifest):
+    key = "%s|%s|%s" % (manifest['source_fingerprint'], manifest['relations'], manifest['min_weight'])
+    return os.path.join(config.conceptnet_extract_dir, "extract_%s/" % utils.hash_of_string(key)[:16])
+
+def find_ConceptNet_extract(conceptnet_filename, rel_list, min_weight): # dirname of a matching extract, or None
+    wanted = get_ConceptNet_extract_manifest(conceptnet_filename, rel_list, min_weight)
+    if wanted['source_fingerprint'] is not None:
+        candidates = [get_ConceptNet_extract_dirname(wanted)]
+    elif os.path.isdir(config.conceptnet_extract_dir): # no CSV, any extract of the same file made with the same filters
+        candidates = [os.path.join(config.conceptnet_extract_dir, d) for d in sorted(os.listdir(config.conceptnet_extract_dir))]
+    else:
+        candidates = []
+    for dirname in candidates:
+        manifest_filename = os.path.join(dirname, 'manifest.json')
+        if not os.path.exists(manifest_filename):
+            continue
+        with open(manifest_filename) as f:
+            manifest = json.load(f)
+        if all(manifest.get(key) == val for key, val in wanted.items() if key != 'source_fingerprint' or val is not None):
+            return dirname
+    return None
+
+def extract_ConceptNet(conceptnet_filename, rel_list, min_weight=1.0, num_workers=None):
+    # One pass over the CSV, then save the retained edges; returns the extract as load_ConceptNet_extract does
+    nodes, edges = read_ConceptNet(conceptnet_filename, rel_list, num_workers, min_weight)
+    manifest = get_ConceptNet_extract_manifest(conceptnet_filename, rel_list, min_weight)
+    manifest['relation_names'] = sorted(set(rel for _, _, rel, _ in edges)) if rel_list is None else manifest['relations']
+    assert len(manifest['relation_names']) <= 256, "Too many relations for a uint8 relation id"
+
+    nodes = sorted(nodes)
+    node_to_id = {n: idx for idx, n in enumerate(nodes)}
+    rel_to_id = {rel: idx for idx, rel in enumerate(manifest['relation_names'])}
+    extract = {'nodes': nodes,
+               'sub': np.fromiter((node_to_id[sub] for sub, _, _, _ in edges), dtype=np.int32, count=len(edges)),
+               'obj': np.fromiter((node_to_id[obj] for _, obj, _, _ in edges), dtype=np.int32, count=len(edges)),
+               'relation': np.fromiter((rel_to_id[rel] for _, _, rel, _ in edges), dtype=np.uint8, count=len(edges)),
+               'weight': np.fromiter((weight for _, _, _, weight in edges), dtype=np.float64, count=len(edges)),
+               'manifest': manifest,
+              }
+    del edges
+    # float16 rounded down, so that weight >= threshold is unchanged for any threshold representable in float16 (e.g. 1.0)
+    weight = extract['weight'].astype(np.float16)
+    extract['weight'] = np.where(weight.astype(np.float64) > extract['weight'], np.nextafter(weight, np.float16(-np.inf)), weight)
+
+    dirname = get_ConceptNet_extract_dirname(manifest)
+    save_ConceptNet_extract(dirname, extract)
+    print("ConceptNet extract saved to %s: %d nodes, %d edges" % (dirname, len(nodes), extract['sub'].shape[0]))
+    return extract
+
+def save_ConceptNet_extract(dirname, extract):
+    os.makedirs(dirname, exist_ok=True)
+    manifest_filename = os.path.join(dirname, 'manifest.json')
+    if os.path.exists(manifest_filename):
+        os.remove(manifest_filename)
+    nodes = String_table.from_strings(extract['nodes'])
+    arrays = {'nodes_data': nodes.data, 'nodes_offsets': nodes.offsets}
+    arrays.update({name: extract[name] for name in ['sub', 'obj', 'relation', 'weight']})
+    for name, array in arrays.items():
+        tmp_filename = os.path.join(dirname, '%s.%d.tmp.npy' % (name, os.getpid()))
+        np.save(tmp_filename, array)
+        os.replace(tmp_filename, os.path.join(dirname, name + '.npy'))
+    manifest = dict(extract['manifest'], num_nodes=len(nodes), num_edges=int(extract['sub'].shape[0]))
+    tmp_filename = '%s.%d.tmp' % (manifest_filename, os.getpid())
+    with open(tmp_filename, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_filename, manifest_filename)
+
+def load_ConceptNet_extract(dirname):
+    with open(os.path.join(dirname, 'manifest.json')) as f:
+        manifest = json.load(f)
+    arrays = {name: np.load(os.path.join(dirname, name + '.npy')) for name in ['nodes_data', 'nodes_offsets', 'sub', 'obj', 'relation', 'weight']}
+    extract = {name: arrays[name] for name in ['sub', 'obj', 'relation', 'weight']}
+    extract['nodes'] = list(String_table(arrays['nodes_data'], arrays['nodes_offsets']))
+    extract['manifest'] = manifest
+    print("ConceptNet extract loaded from %s: %d nodes, %d edges" % (dirname, len(extract['nodes']), extract['sub'].shape[0]))
+    return extract
+
+
+def load_ConceptNet(num_workers=None, rel_list=REL_LIST, min_weight=MIN_WEIGHT, force_process=False):
+    global lemmatise_dict, ALL_NODES_DATA
     
     filename = config.conceptnet_path
     
+    # Read all nodes and the one hop edges of every relation, from a previous extract if there is one, otherwise in a single pass over the CSV.
+    # Relations and weights are kept, the edges used for the KG vectors are selected afterwards (select_ConceptNet_edges).
+    extract_dirname = None if force_process else find_ConceptNet_extract(filename, None, 0.0)
+    if extract_dirname is not None:
+        extract = load_ConceptNet_extract(extract_dirname)
+    else:
+        print("Reading ConceptNet")
+        extract = extract_ConceptNet(filename, None, 0.0, num_workers)
+    ALL_NODES = extract['nodes']
+    
     # Find all lemmatised nodes
-    print("Reading all nodes from ConceptNet")
-    ALL_NODES = read_all_nodes(filename)
     print('Before lemmatising, no. of all nodes = ', len(ALL_NODES))
-    lemmatise_dict = create_lemmatised_dict(ALL_NODES)
-    ALL_NODES = set(lemmatise_dict.values())
-    print('After lemmatising, no. of all nodes = ', len(ALL_NODES))
-    
-    # Create all lemmatised nodes objects in the process
-    for n in ALL_NODES:
-        NODES_DATA[n] = ConceptNet_node(n)
-    del ALL_NODES
-    print('Finish creating lemmatised nodes')
+    lemmatise_dict = create_lemmatised_dict(ALL_NODES, filename if os.path.exists(filename) else None, num_workers)
+    lemma_uris = sorted(set(lemmatise_dict.values()))
+    print('After lemmatising, no. of all nodes = ', len(lemma_uris))
     
-    # Load one hop data from ConceptNet
-    rel_list = ['/r/IsA', '/r/PartOf', '/r/AtLocation', '/r/RelatedTo']
-    load_one_hop_data(filename, NODES_DATA, rel_list)    
+    # Build the CSR graph of lemmatised nodes and register one hop data from ConceptNet
+    lemma_to_id = {uri: idx for idx, uri in enumerate(lemma_uris)}
+    lemma_id_of_node = np.array([lemma_to_id[lemmatise_dict[n]] for n in ALL_NODES], dtype=np.int64)
+    ALL_NODES_DATA = ConceptNet_graph.from_id_pairs(lemma_uris, lemma_id_of_node[extract['sub']], lemma_id_of_node[extract['obj']],
+                                                    relations=extract['relation'], weights=extract['weight'], relation_names=extract['manifest']['relation_names'])
+    del ALL_NODES, extract
     print('Finish loading one hop data')
+    select_ConceptNet_edges(rel_list, min_weight)
+
+def select_ConceptNet_edges(rel_list, min_weight):
+    # NODES_DATA = the graph of the given relations and minimum weight, e.g. to compute another KG vector variant from the same loaded graph
+    global NODES_DATA
+    NODES_DATA = ALL_NODES_DATA.subgraph(rel_list, min_weight)
+    print('Selected edges of', rel_list, 'with weight >=', min_weight, ', no. of edges =', NODES_DATA.indices.shape[0] // 2)
 
 ### Creating KG vector function
 
-def get_vector_of(n, all_c_nodes, hop): # n = uri, c = Category_node
-    v = np.zeros(3 * hop + 1)
-    v[0] = 1.0 if n in all_c_nodes else 0.0
-    for i in range(hop):
-        have_hops = [n in NODES_DATA[c].find_neighbors(i+1) for c in all_c_nodes]
-        if len(have_hops) > 0:
-            v[3 * i + 1] = float(any(have_hops))
-            v[3 * i + 2] = float(sum(have_hops))
-            v[3 * i + 3] = float(np.mean(have_hops))
-        else:
-            v[3 * i + 1] = 0.0
-            v[3 * i + 2] = 0.0
-            v[3 * i + 3] = 0.0
+def get_vectors_of(neighbor_ids, all_c_nodes, hop): # KG vectors of the nodes neighbor_ids given the nodes all_c_nodes of a class, one row per id
+    neighbor_ids = np.asarray(neighbor_ids)
+    c_node_ids = [NODES_DATA.get_id(c) for c in all_c_nodes]
+    v = np.zeros((neighbor_ids.shape[0], 3 * hop + 1))
+    v[:, 0] = np.isin(neighbor_ids, c_node_ids)
+    if len(c_node_ids) == 0:
+        return v
+    # have_hops counts: for each neighbor, how many nodes in all_c_nodes have it exactly i+1 hops away
+    counts = np.zeros((neighbor_ids.shape[0], hop))
+    for c in c_node_ids:
+        frontiers = NODES_DATA.get_frontiers(c, hop)
+        for i in range(hop):
+            counts[:, i] += np.isin(neighbor_ids, frontiers[i + 1], assume_unique=True)
+    v[:, 1::3] = counts > 0
+    v[:, 2::3] = counts
+    v[:, 3::3] = counts / len(c_node_ids)
     return v
 
+def get_vectors_of_node_groups(node_groups, hop, restrict_ids=None, report=None): # node_groups = Category.nodes, returns (uris of all neighbors, [num_neighbors, 3 * (3 * hop + 1)] matrix)
+    all_c_nodes = set(node_groups['the_class']) | set(node_groups['super_class']) | set(node_groups['description'])
+    neighbor_ids = NODES_DATA.get_neighbor_ids_of_cluster(all_c_nodes, hop, report=report)
+    if restrict_ids is not None: # rows are independent of each other, so dropping neighbors does not change the kept rows
+        neighbor_ids = np.intersect1d(neighbor_ids, restrict_ids, assume_unique=True)
+    matrix = np.concatenate((get_vectors_of(neighbor_ids, node_groups['the_class'], hop), get_vectors_of(neighbor_ids, node_groups['super_class'], hop), get_vectors_of(neighbor_ids, node_groups['description'], hop)), axis = 1)
+    return NODES_DATA.get_uris(neighbor_ids), matrix
+
+def get_vectors_of_class(c, hop): # c = Category
+    return get_vectors_of_node_groups(c.nodes, hop)
+
+def write_vectors_of_class(args): # args = (label, node_groups, filename), runs in the main process or in a pool worker
+    label, node_groups, filename = args
+    report = list() # pruning counts per hop of the class neighborhood, see ConceptNet_graph.expand_frontiers
+    all_neighbors, matrix = get_vectors_of_node_groups(node_groups, hop = 3, restrict_ids = VOCAB_NODE_IDS, report = report)
+    vectors = {n: matrix[idx] for idx, n in enumerate(all_neighbors)}
+    # Write to a temporary file and rename, so an interrupted run never leaves a partial pickle behind
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, "wb") as f:
+        pickle.dump(vectors, f)
+    os.replace(tmp_filename, filename)
+    return label, len(all_neighbors), report
+
+def get_vocab_node_ids(vocab_filename):
+    # Ids of the nodes that dataloader.get_kg_vector can look up for a word of the vocab file
+    # (tl.nlp vocabulary, one "word count" per line): the word itself and its lemma form
+    with open(vocab_filename, encoding = 'utf-8') as f:
+        words = sorted(set(line.split()[0].lower() for line in f if line.strip()))
+    uris = set()
+    for word, lemma_label, lemma_uri in lemmatise_ConceptNet_labels(words):
+        uris.update(['/c/en/' + word, standardized_uri('en', word), '/c/en/' + lemma_label, lemma_uri])
+    node_ids = np.unique(np.array([NODES_DATA.get_id(uri) for uri in uris if uri in NODES_DATA], dtype=np.int32))
+    print('No. of vocab words =', len(words), ', no. of vocab nodes =', node_ids.shape[0])
+    return node_ids
+
+def save_kg_vector_manifests(filenames, class_filename, vocab_filename, rel_list, min_weight, limits):
+    # A vocab-restricted run writes the same pickle filenames as a full run: the manifest next to each pickle records
+    # which one it was, with the fingerprint of the vocab file, so that dataloader.load_kg_vector can tell
+    params = {'vocab_filename': vocab_filename,
+              'vocab': utils.file_fingerprint(vocab_filename) if vocab_filename is not None else None,
+              'relations': sorted(rel_list) if rel_list is not None else None,
+              'min_weight': min_weight,
+              'limits': limits.to_dict() if limits is not None else None}
+    sources = [class_filename] + ([vocab_filename] if vocab_filename is not None else [])
+    for filename in filenames:
+        artifact_cache.save_manifest(filename, 'kg_vectors', KG_VECTORS_VERSION, sources, params)
+
+def save_graph_snapshot(node_data_dir, rel_list, min_weight):
+    # Keyed by the ConceptNet file and the edge selection it was built from, see load_graph_snapshot
+    NODES_DATA.save_snapshot(node_data_dir, extra_manifest = {'conceptnet_fingerprint': utils.file_fingerprint(config.conceptnet_path) if os.path.exists(config.conceptnet_path) else None,
+                                                              'relations': sorted(rel_list) if rel_list is not None else None,
+                                                              'min_weight': min_weight})
+    print('Saved ConceptNet graph snapshot to', node_data_dir)
+
+def get_graph_snapshot_dirname(node_data_dir, rel_list, min_weight):
+    # Snapshot of an edge selection narrowed from the snapshot in node_data_dir, kept next to it
+    key = "%s|%s" % (sorted(rel_list) if rel_list is not None else None, min_weight)
+    return "%s_%s/" % (node_data_dir.rstrip('/'), utils.hash_of_string(key)[:16])
+
+def load_fresh_snapshot_manifest(dirname):
+    # Manifest of the snapshot in dirname, None if there is none or the ConceptNet CSV changed since
+    manifest = ConceptNet_graph.load_snapshot_manifest(dirname)
+    if manifest is None:
+        return None
+    if os.path.exists(config.conceptnet_path) and manifest.get('conceptnet_fingerprint') not in (None, utils.file_fingerprint(config.conceptnet_path)):
+        print('ConceptNet graph snapshot in', dirname, 'is out of date')
+        return None
+    return manifest
+
+def is_snapshot_of(manifest, rel_list, min_weight):
+    return manifest.get('relations', sorted(REL_LIST)) == (sorted(rel_list) if rel_list is not None else None) and manifest.get('min_weight', MIN_WEIGHT) == min_weight
+
+def load_graph_snapshot(node_data_dir, rel_list, min_weight):
+    # (graph, snapshot dirname). The snapshot replaces the raw CSV when the CSV is missing or unchanged, and its edges include the requested ones.
+    # A graph narrowed from the snapshot of node_data_dir is saved to its own directory (get_graph_snapshot_dirname),
+    # so that node_data_dir keeps the broader selection; (None, node_data_dir) if the CSV has to be read.
+    selection_dir = get_graph_snapshot_dirname(node_data_dir, rel_list, min_weight)
+    for dirname in [node_data_dir, selection_dir]:
+        manifest = load_fresh_snapshot_manifest(dirname)
+        if manifest is not None and is_snapshot_of(manifest, rel_list, min_weight):
+            print('Load ConceptNet graph snapshot from', dirname)
+            return ConceptNet_graph.load_snapshot(dirname, mmap_mode='r'), dirname
+
+    # Otherwise select the requested edges, if the snapshot has all of them with their relations and weights
+    manifest = load_fresh_snapshot_manifest(node_data_dir)
+    if manifest is None:
+        return None, node_data_dir
+    snapshot_rel_list = manifest.get('relations', sorted(REL_LIST))
+    snapshot_min_weight = manifest.get('min_weight', MIN_WEIGHT)
+    has_edges = 'relations' in manifest['arrays'] and \
+                (snapshot_rel_list is None or (rel_list is not None and set(rel_list) <= set(snapshot_rel_list))) and \
+                (snapshot_min_weight or 0.0) <= (min_weight or 0.0)
+    if not has_edges:
+        print('ConceptNet graph snapshot in', node_data_dir, 'does not include the edges of', rel_list, 'with weight >=', min_weight)
+        return None, node_data_dir
+    print('Load ConceptNet graph snapshot from', node_data_dir, 'and select the edges of', rel_list, 'with weight >=', min_weight)
+    return ConceptNet_graph.load_snapshot(node_data_dir, mmap_mode='r').subgraph(rel_list, min_weight), selection_dir
+
 
 ## Main Program
-def main_program(class_filename, node_data_filename, kg_vector_dir, kg_vector_prefix):
-    # - Load conceptnet
-    load_ConceptNet()
+def main_program(class_filename, node_data_dir, kg_vector_dir, kg_vector_prefix, num_workers=1, vocab_filename=None, rel_list=REL_LIST, min_weight=MIN_WEIGHT, limits=None, force_process=False):
+    # vocab_filename: if given, only the vectors of nodes reachable through the dataset vocab are computed and stored
+    # rel_list, min_weight: the ConceptNet edges the neighborhoods are expanded through
+    # limits: Expansion_limits for hub nodes and the size of the neighborhoods, None for no limit
+    global NODES_DATA, VOCAB_NODE_IDS
+    # - Load conceptnet (from the graph snapshot of a previous run if there is one)
+    NODES_DATA, snapshot_dir = (None, node_data_dir) if force_process else load_graph_snapshot(node_data_dir, rel_list, min_weight)
+    if NODES_DATA is None:
+        load_ConceptNet(rel_list=rel_list, min_weight=min_weight, force_process=force_process)
+    NODES_DATA.set_expansion_limits(limits)
 
     # - Load class data and form a cluster of nodes for each class
     class_nodes = set()
@@ -261,34 +539,46 @@ def main_program(class_filename, node_data_filename, kg_vector_dir, kg_vector_pr
 
     # - Find neighbors of nodes in each cluster 
 
-    for c in tqdm(class_nodes):
-        print('Processing class', c)
-        NODES_DATA[c].find_neighbors(3)
+    NODES_DATA.find_neighbors_of_nodes([NODES_DATA.get_id(c) for c in class_nodes], hop = 3)
 
-    pickle.dump(NODES_DATA, open(node_data_filename, "wb"))
+    save_graph_snapshot(snapshot_dir, rel_list, min_weight)
 
+    VOCAB_NODE_IDS = get_vocab_node_ids(vocab_filename) if vocab_filename is not None else None
 
     # - Calculate KG vectors for each class
 
-    for c in tqdm(classes):
-        all_c_nodes = c.get_all_nodes()
-        all_neighbors = get_neighbors_of_cluster(all_c_nodes, hop = 3)
-        print(c, len(all_neighbors))
-        
-        vectors = dict()
-        for n in all_neighbors:
-            # Consider each partition of nodes separately
-            vectors[n] = np.concatenate((get_vector_of(n, c.nodes['the_class'], hop = 3), get_vector_of(n, c.nodes['super_class'], hop = 3), get_vector_of(n, c.nodes['description'], hop = 3)), axis = 0) 
-
-        pickle.dump(vectors, open(kg_vector_dir + kg_vector_prefix + c.label + ".pickle", "wb"))
-        print('Finish calculating vectors for', c.label)
+    # Consider each partition of nodes separately
+    jobs = [(c.label, c.nodes, kg_vector_dir + kg_vector_prefix + c.label + ".pickle") for c in classes]
+    reports = dict()
+    if num_workers > 1:
+        # Forked workers share the pages of the memory-mapped snapshot instead of copying the graph
+        NODES_DATA = ConceptNet_graph.load_snapshot(snapshot_dir, mmap_mode='r')
+        with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+            for label, num_neighbors, report in tqdm(pool.imap_unordered(write_vectors_of_class, jobs), total=len(jobs)):
+                print('Finish calculating vectors for', label, num_neighbors)
+                reports[label] = report
+    else:
+        for job in tqdm(jobs):
+            label, num_neighbors, report = write_vectors_of_class(job)
+            print('Finish calculating vectors for', label, num_neighbors)
+            reports[label] = report
+    save_kg_vector_manifests([filename for _, _, filename in jobs], class_filename, vocab_filename, rel_list, min_weight, limits)
+
+    # - Report the nodes and edges pruned by the expansion limits
+    if limits is not None:
+        print(limits)
+        for label in sorted(reports):
+            print(label, ', '.join('hop %d: %d hubs, %d pruned edges, %d pruned nodes' % (r['hop'], r['hubs'], r['pruned_edges'], r['pruned_nodes']) for r in reports[label]))
+    with open(kg_vector_dir + kg_vector_prefix + "expansion_report.json", "w") as f:
+        json.dump({'limits': limits.to_dict() if limits is not None else None, 'vocab_filename': vocab_filename, 'classes': reports}, f, indent=2)
 
 if __name__ == "__main__":
     print(config.dataset)
+    limits = Expansion_limits(config.args.maxdegree, config.args.hubs, config.args.maxnodes) if config.args.maxdegree is not None or config.args.maxnodes is not None else None
     if config.dataset == "dbpedia":
-        main_program(config.zhang15_dbpedia_class_label_path, config.zhang15_dbpedia_kg_vector_node_data_path, config.zhang15_dbpedia_kg_vector_dir, config.zhang15_dbpedia_kg_vector_prefix)
+        main_program(config.zhang15_dbpedia_class_label_path, config.zhang15_dbpedia_kg_vector_node_data_path, config.zhang15_dbpedia_kg_vector_dir, config.zhang15_dbpedia_kg_vector_prefix, num_workers=config.args.workers, vocab_filename=config.zhang15_dbpedia_vocab_path if config.args.kgvocab else None, limits=limits)
     elif config.dataset == "20news":
-        main_program(config.news20_class_label_path, config.news20_kg_vector_node_data_path, config.news20_kg_vector_dir, config.news20_kg_vector_prefix)
+        main_program(config.news20_class_label_path, config.news20_kg_vector_node_data_path, config.news20_kg_vector_dir, config.news20_kg_vector_prefix, num_workers=config.args.workers, vocab_filename=config.news20_vocab_path if config.args.kgvocab else None, limits=limits)
     else:
         raise Exception("config.dataset %s not found" % config.dataset)
     pass
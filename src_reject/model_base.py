@@ -59,3 +59,21 @@ class Base_Model():
         # learning rate operators
         # optim operators
         pass
+
+
+class Word_embed_lookup():
+    # Word ids as inputs: a model given the word embedding matrix is fed the padded word ids of the texts
+    # (encode_seqs_id) and looks up their embeddings in the graph, instead of being fed the
+    # [batch_size, max_length, word_embedding_dim] embeddings. The matrix is a non-trainable local variable,
+    # set once per session (initialize) and not saved by tf.train.Saver, so the checkpoints are the same as
+    # those of a model fed with the embeddings.
+
+    def __init__(self, word_embed_mat, batch_size, max_length):
+        self.word_embed_mat = word_embed_mat
+        self.encode_seqs_id = tf.placeholder(dtype=tf.int32, shape=[batch_size, max_length], name="encode_seqs_id")
+        self.word_embed_init = tf.placeholder(dtype=tf.float32, shape=word_embed_mat.shape, name="word_embed_init")
+        self.word_embed = tf.Variable(self.word_embed_init, trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES], name="word_embed")
+        self.encode_seqs = tf.nn.embedding_lookup(self.word_embed, self.encode_seqs_id)
+
+    def initialize(self, sess):
+        sess.run(self.word_embed.initializer, feed_dict={self.word_embed_init: self.word_embed_mat})
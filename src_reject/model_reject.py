@@ -16,6 +16,7 @@ import numpy as np
 import logging
 
 import config
+import model_base
 
 class Model4Reject():
 
@@ -29,7 +30,8 @@ class Model4Reject():
             seen_classes,
             unseen_classes,
             word_embedding_dim=config.word_embedding_dim,
-            max_length=config.max_length
+            max_length=config.max_length,
+            word_embed_mat=None
     ):
         self.model_name = model_name
         self.start_learning_rate = start_learning_rate
@@ -37,6 +39,7 @@ class Model4Reject():
         self.decay_steps = decay_steps
         self.word_embedding_dim = word_embedding_dim
         self.max_length = max_length
+        self.word_embed_mat = word_embed_mat # fed with word ids if given, see model_base.Word_embed_lookup
         self.main_class = main_class
         self.seen_classes = seen_classes
         self.unseen_classes = unseen_classes
@@ -49,7 +52,14 @@ class Model4Reject():
 
     def __create_placeholders__(self):
         # the placeholder for inputs
-        self.encode_seqs = tf.placeholder(dtype=tf.float32, shape=[None, self.max_length, self.word_embedding_dim], name="encode_seqs")
+        if self.word_embed_mat is None:
+            self.word_embed_lookup = None
+            self.encode_seqs = tf.placeholder(dtype=tf.float32, shape=[None, self.max_length, self.word_embedding_dim], name="encode_seqs")
+            self.encode_seqs_input = self.encode_seqs
+        else:
+            self.word_embed_lookup = model_base.Word_embed_lookup(self.word_embed_mat, None, self.max_length)
+            self.encode_seqs = self.word_embed_lookup.encode_seqs
+            self.encode_seqs_input = self.word_embed_lookup.encode_seqs_id
         self.label_logits = tf.placeholder(dtype=tf.float32, shape=[None, 1], name="label_logits")
         
         # self.encode_seqs_anc = tf.placeholder(dtype=tf.float32, shape=[None, self.max_length, self.word_embedding_dim], name="encode_seqs_anc")
@@ -28,17 +28,26 @@ class Model4Seen(model_base.Base_Model):
             decay_steps,
             number_of_seen_classes,
             word_embedding_dim=config.word_embedding_dim,
-            max_length=config.max_length
+            max_length=config.max_length,
+            word_embed_mat=None
     ):
         self.number_of_seen_classes = number_of_seen_classes
         self.word_embedding_dim = word_embedding_dim
         self.max_length = max_length
+        self.word_embed_mat = word_embed_mat # fed with word ids if given, see model_base.Word_embed_lookup
 
         super(Model4Seen, self).__init__(model_name, start_learning_rate, decay_rate, decay_steps)
 
 
     def __create_placeholders__(self):
-        self.encode_seqs = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.word_embedding_dim], name="encode_seqs")
+        if self.word_embed_mat is None:
+            self.word_embed_lookup = None
+            self.encode_seqs = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.word_embedding_dim], name="encode_seqs")
+            self.encode_seqs_input = self.encode_seqs
+        else:
+            self.word_embed_lookup = model_base.Word_embed_lookup(self.word_embed_mat, config.batch_size, self.max_length)
+            self.encode_seqs = self.word_embed_lookup.encode_seqs
+            self.encode_seqs_input = self.word_embed_lookup.encode_seqs_id
         self.category_target_index = tf.placeholder(dtype=tf.int32, shape=[config.batch_size, ], name="category_target_index")
 
     def __create_model__(self):
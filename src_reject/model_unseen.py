@@ -31,11 +31,13 @@ class Model4Unseen(model_base.Base_Model):
             kg_embedding_dim=config.kg_embedding_dim,
             max_length=config.max_length,
             vocab_size=30000,
+            word_embed_mat=None,
     ):
         self.word_embedding_dim = word_embedding_dim
         self.kg_embedding_dim = kg_embedding_dim
         self.max_length = max_length
         self.vocab_size = vocab_size
+        self.word_embed_mat = word_embed_mat # fed with word ids if given, see model_base.Word_embed_lookup
 
         super(Model4Unseen, self).__init__(model_name, start_learning_rate, decay_rate, decay_steps)
 
@@ -44,7 +46,14 @@ class Model4Unseen(model_base.Base_Model):
         self.target_mask = tf.placeholder(dtype=tf.int32, shape=[config.batch_size, self.max_length], name="target_mask")
         self.decode_seqs = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.word_embedding_dim], name="decode_seqs")
 
-        self.encode_seqs = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.word_embedding_dim], name="encode_seqs")
+        if self.word_embed_mat is None:
+            self.word_embed_lookup = None
+            self.encode_seqs = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.word_embedding_dim], name="encode_seqs")
+            self.encode_seqs_input = self.encode_seqs
+        else:
+            self.word_embed_lookup = model_base.Word_embed_lookup(self.word_embed_mat, config.batch_size, self.max_length)
+            self.encode_seqs = self.word_embed_lookup.encode_seqs
+            self.encode_seqs_input = self.word_embed_lookup.encode_seqs_id
         self.class_label_seqs = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.word_embedding_dim], name="class_label_seqs")
         self.kg_vector = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, self.max_length, self.kg_embedding_dim], name="kg_score")
         self.category_logits = tf.placeholder(dtype=tf.float32, shape=[config.batch_size, 1], name="category_logits")
@@ -591,7 +591,7 @@ def visualise_wordvector():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.zhang15_dbpedia_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -646,7 +646,7 @@ def tf_idf_document(vocab, glove_mat, text_seqs, df_filename, df_out_filename):
     assert len(text_seqs) == df.shape[0]
 
     print("IDF")
-    appearance_of_word = np.zeros(vocab.unk_id + 1)
+    appearance_of_word = np.zeros(dataloader.get_vocab_size(vocab))
     for idx, document in enumerate(text_seqs):
         word_set = set()
         for wordid in document:
@@ -704,7 +704,7 @@ def tf_idf_category():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.zhang15_dbpedia_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
 
     assert np.sum(glove_mat[vocab.start_id]) == 0
@@ -732,7 +732,7 @@ def tf_idf_category():
 
     import math
     total_number_of_category = len(all_content_for_each_class_dict.keys())
-    occur_of_word_in_category_list = np.zeros(vocab.unk_id + 1)
+    occur_of_word_in_category_list = np.zeros(dataloader.get_vocab_size(vocab))
     number_of_word_in_each_category_dict_list = dict()
 
     print("Counting number of appearance ...")
@@ -740,7 +740,7 @@ def tf_idf_category():
         full_text = all_content_for_each_class_dict[class_id]
 
         assert class_id not in number_of_word_in_each_category_dict_list
-        number_of_word_in_each_category_dict_list[class_id] = np.zeros(vocab.unk_id + 1)
+        number_of_word_in_each_category_dict_list[class_id] = np.zeros(dataloader.get_vocab_size(vocab))
 
         word_set = set()
 
@@ -770,7 +770,7 @@ def tf_idf_category():
         tfidf_dict_list[class_id] = tf_dict_list[class_id] * idf_list
 
         # manually set some special words to 0
-        for word_id in range(vocab.unk_id + 1):
+        for word_id in range(dataloader.get_vocab_size(vocab)):
             if np.sum(glove_mat[word_id]) == 0:
                 tfidf_dict_list[class_id][word_id] = 0
 
@@ -14,6 +14,7 @@ Example:
 >>> standardized_uri('en', '24 hours')
 '/c/en/##_hours'
 """
+import functools
 import wordfreq
 import re
 
@@ -24,7 +25,15 @@ DROP_FIRST = ['to']
 DOUBLE_DIGIT_RE = re.compile(r'[0-9][0-9]')
 DIGIT_RE = re.compile(r'[0-9]')
 
+# Terms made of ASCII letters and digits separated by single spaces or underscores:
+# wordfreq would only lowercase them and split them at the separators
+ASCII_TERM_RE = re.compile(r'[A-Za-z0-9]+(?:[ _][A-Za-z0-9]+)*\Z')
+SEPARATOR_RE = re.compile(r'[ _]')
 
+STANDARDIZED_URI_CACHE_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=STANDARDIZED_URI_CACHE_SIZE)
 def standardized_uri(language, term):
     """
     Get a URI that is suitable to label a row of a vector space, by making sure
@@ -42,6 +51,22 @@ def standardized_uri(language, term):
     return replace_numbers(term)
 
 
+def standardized_uris(language, terms):
+    """
+    Batch version of standardized_uri: a list with the URI of each term.
+
+    Each distinct term is standardized once. The results do not go through the
+    LRU cache of standardized_uri, so a large batch of distinct terms (such as
+    all the labels of ConceptNet) does not evict the terms that are looked up
+    repeatedly.
+    """
+    uri_of_term = dict()
+    for term in terms:
+        if term not in uri_of_term:
+            uri_of_term[term] = standardized_uri.__wrapped__(language, term)
+    return [uri_of_term[term] for term in terms]
+
+
 def english_filter(tokens):
     """
     Given a list of tokens, remove a small list of English stopwords. This
@@ -82,7 +107,10 @@ def _standardized_concept_uri(language, term):
 
 
 def _standardized_text(text, token_filter):
-    tokens = simple_tokenize(text.replace('_', ' '))
+    if ASCII_TERM_RE.match(text):
+        tokens = SEPARATOR_RE.split(text.lower())
+    else:
+        tokens = simple_tokenize(text.replace('_', ' '))
     if token_filter is not None:
         tokens = token_filter(tokens)
     return '_'.join(tokens)
@@ -0,0 +1,162 @@
+import os
+import struct
+import numpy as np
+
+## Ragged token store
+# Token id sequences of a corpus stored back to back: sequence i is tokens[offsets[i]:offsets[i+1]].
+# Saved as a directory with tokens.npy (int32) and offsets.npy (int64), loaded memory-mapped.
+
+class Token_store:
+    # Indexable like the list of int lists it replaces: store[i] is a list of int, store[i:j] a list of such lists
+
+    def __init__(self, tokens, offsets, dirname=None):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.dirname = dirname # directory the store was loaded from, if any
+
+    @staticmethod
+    def from_lists(seqs):
+        offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+        np.cumsum([len(seq) for seq in seqs], out=offsets[1:])
+        tokens = np.fromiter((word_id for seq in seqs for word_id in seq), dtype=np.int32, count=offsets[-1])
+        return Token_store(tokens, offsets)
+
+    @staticmethod
+    def from_arrays(arrays): # arrays = iterable of 1-d int arrays, one per sequence
+        arrays = list(arrays)
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([array.shape[0] for array in arrays], out=offsets[1:])
+        tokens = np.concatenate(arrays).astype(np.int32) if arrays else np.zeros(0, dtype=np.int32)
+        return Token_store(tokens, offsets)
+
+    @staticmethod
+    def exists(dirname):
+        return os.path.exists(os.path.join(dirname, 'offsets.npy'))
+
+    @staticmethod
+    def load(dirname, mmap_mode='r'):
+        return Token_store(np.load(os.path.join(dirname, 'tokens.npy'), mmap_mode=mmap_mode),
+                           np.load(os.path.join(dirname, 'offsets.npy'), mmap_mode=mmap_mode), dirname)
+
+    def save(self, dirname):
+        # offsets.npy is written last, so a directory without it is an incomplete store (see exists)
+        os.makedirs(dirname, exist_ok=True)
+        if Token_store.exists(dirname):
+            os.remove(os.path.join(dirname, 'offsets.npy'))
+        for name, array in [('tokens', self.tokens), ('offsets', self.offsets)]:
+            tmp_filename = os.path.join(dirname, '%s.%d.tmp.npy' % (name, os.getpid()))
+            np.save(tmp_filename, np.asarray(array))
+            os.replace(tmp_filename, os.path.join(dirname, name + '.npy'))
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Token_store index out of range')
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]].tolist()
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def get_array(self, idx): # sequence idx as an int32 array (a view, no copy)
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def get_lengths(self):
+        return np.diff(self.offsets)
+
+## Streaming writer
+# Appends sequences chunk by chunk, so a corpus can be written without holding it in memory.
+# Both arrays are streamed to .npy files whose header is rewritten with the final length on close. The header
+# is written by hand into a fixed NPY_HEADER_SIZE bytes, so the length can grow without moving the data
+# whatever padding the installed numpy would give it (older versions only align it to 16 bytes).
+
+NPY_HEADER_SIZE = 128 # magic, version, header length and the header dict padded with spaces, a multiple of 64
+
+class Npy_appender:
+    # Rows of shape row_shape appended along the first axis
+
+    def __init__(self, filename, dtype, row_shape=()):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.length = 0
+        # the header of the largest possible length has to fit, checked before anything is written
+        self.make_header(np.iinfo(np.int64).max)
+        self.f = open(filename, 'wb')
+        self.write_header()
+
+    def make_header(self, length):
+        # npy format 1.0 header of length rows, NPY_HEADER_SIZE bytes long
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(self.dtype), (length,) + self.row_shape)
+        header_len = NPY_HEADER_SIZE - len(np.lib.format.magic(1, 0)) - 2
+        if len(header) + 1 > header_len:
+            raise ValueError('npy header of %s does not fit in %d bytes: %s' % (self.filename, NPY_HEADER_SIZE, header))
+        return np.lib.format.magic(1, 0) + struct.pack('<H', header_len) + (header.ljust(header_len - 1) + '\n').encode('latin1')
+
+    def write_header(self):
+        self.f.seek(0)
+        self.f.write(self.make_header(self.length))
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        assert array.shape[1:] == self.row_shape
+        self.f.write(array.tobytes())
+        self.length += array.shape[0]
+
+    def close(self):
+        self.f.flush()
+        end = self.f.tell()
+        self.write_header()
+        self.f.seek(end)
+        self.f.close()
+
+class Token_store_writer:
+    # with Token_store_writer(dirname) as writer: writer.append(arrays) for each chunk of sequences
+
+    def __init__(self, dirname):
+        os.makedirs(dirname, exist_ok=True)
+        if Token_store.exists(dirname):
+            os.remove(os.path.join(dirname, 'offsets.npy'))
+        self.dirname = dirname
+        self.tokens = Npy_appender(self.get_tmp_filename('tokens'), np.int32)
+        self.offsets = Npy_appender(self.get_tmp_filename('offsets'), np.int64)
+        self.offsets.append(np.zeros(1, dtype=np.int64))
+        self.num_seqs = 0
+
+    def get_tmp_filename(self, name):
+        return os.path.join(self.dirname, '%s.%d.tmp.npy' % (name, os.getpid()))
+
+    def append(self, arrays): # arrays = list of 1-d int arrays, one per sequence
+        if len(arrays) == 0:
+            return
+        lengths = np.fromiter((array.shape[0] for array in arrays), dtype=np.int64, count=len(arrays))
+        self.offsets.append(self.tokens.length + np.cumsum(lengths))
+        self.tokens.append(np.concatenate(arrays))
+        self.num_seqs += len(arrays)
+
+    def close(self):
+        # offsets.npy is moved in last, as in Token_store.save
+        for name, appender in [('tokens', self.tokens), ('offsets', self.offsets)]:
+            appender.close()
+            os.replace(appender.filename, os.path.join(self.dirname, name + '.npy'))
+
+    def abort(self):
+        for appender in [self.tokens, self.offsets]:
+            appender.f.close()
+            os.remove(appender.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
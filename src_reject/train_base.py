@@ -36,6 +36,8 @@ class Base_Controller():
         else:
             self.sess = tf.Session(config=gpu_config)
         tl.layers.initialize_global_variables(self.sess)
+        if getattr(self.model, "word_embed_lookup", None) is not None:
+            self.model.word_embed_lookup.initialize(self.sess)
         self.__init_path__()
         self.__init_mkdir__()
 
@@ -95,6 +97,32 @@ class Base_Controller():
         self.sess.run(ops)
         print("[R] Model restored from npz_dict %s" % name)
 
+    # Encoding of texts for the model, used by the controllers which set self.vocab and self.word_embed_mat
+
+    def get_padded_id_matrix(self, text_seqs):
+        return dataloader.get_padded_id_matrix(text_seqs, self.model.max_length, self.vocab.pad_id)
+
+    def get_padded_ids(self, textlist, startid_list=None):
+        return dataloader.get_padded_ids(textlist, self.model.max_length, self.vocab.pad_id, startid_list)
+
+    def encode_padded_ids(self, padded_ids, need_embeddings=False):
+        # (word ids, [batch_size, max_length, word_embedding_dim] word embeddings) fed to the model,
+        # in the buffers of a dataloader.Batch_encoder: valid until the next batch is encoded.
+        # A model looking up the embeddings itself is only fed the ids, the embeddings are then None unless need_embeddings.
+        if getattr(self, "batch_encoder", None) is None:
+            self.batch_encoder = dataloader.Batch_encoder(self.word_embed_mat)
+        with_embeddings = need_embeddings or getattr(self.model, "word_embed_lookup", None) is None
+        return self.batch_encoder.encode(padded_ids, with_embeddings)
+
+    def get_encode_seqs_input(self, encode_seqs_id, encode_seqs_mat):
+        # value fed to self.model.encode_seqs_input: the word ids or the word embeddings of the texts
+        if getattr(self.model, "word_embed_lookup", None) is not None:
+            return encode_seqs_id
+        return encode_seqs_mat
+
+    def prepro_encode(self, textlist):
+        return self.encode_padded_ids(self.get_padded_ids(textlist))
+
 if __name__ == "__main__":
     pass
 
@@ -26,6 +26,7 @@ import config
 import model_reject
 import train_base
 import dataloader
+import dataset_index
 
 # results_path = "../results/Model4Reject" + "/" + datetime.now().strftime("%Y%m%d%H%M%S")
 results_path = "../results/"
@@ -60,15 +61,9 @@ class Controller4Reject(train_base.Base_Controller):
     def get_text_of_seen_class(self, text_seqs, class_list):
         print("Getting text of seen classes")
         assert len(text_seqs) == len(class_list), "Unequal numbers of texts and classes: %d, %d" % (len(text_seqs), len(class_list))
-        seen_text_seqs = list()
-        seen_class_list = list()
-
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                if self.check_seen(class_list[idx]):
-                    seen_text_seqs.append(text)
-                    seen_class_list.append(class_list[idx])
-                bar.update(idx)
+        positions = dataset_index.get_class_index(class_list).get_positions_except(self.unseen_classes)
+        seen_text_seqs = dataset_index.Text_subset.select(text_seqs, positions)
+        seen_class_list = dataset_index.select_classes(class_list, positions)
         assert len(seen_text_seqs) == len(seen_class_list)
         print("Text seqs of seen classes: %d" % len(seen_text_seqs))
         return seen_text_seqs, seen_class_list
@@ -76,28 +71,20 @@ class Controller4Reject(train_base.Base_Controller):
     def get_binary_training_data(self, text_seqs, class_list):
         print("Creating training dataset for class %d" % (self.main_class))
         assert len(text_seqs) == len(class_list)
-        seen_text_seqs = list()
-        seen_class_list = list()
-        negative_text_seqs = list()
+        class_index = dataset_index.get_class_index(class_list)
 
         # Positive examples
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                if class_list[idx] == self.main_class:
-                    seen_text_seqs.append(text)
-                    seen_class_list.append(1.0)
-                else:
-                    negative_text_seqs.append(text)
-                bar.update(idx)
-        assert len(seen_text_seqs) == len(seen_class_list)
-        
+        positive_positions = class_index.get_positions([self.main_class])
+        seen_class_list = [1.0] * len(positive_positions)
+
         # Negative examples
-        random.shuffle(negative_text_seqs)
+        negative_positions = class_index.get_positions_except([self.main_class]).tolist()
+        random.shuffle(negative_positions)
         # seen_text_seqs.extend(negative_text_seqs[:2*len(seen_text_seqs)])
         # seen_class_list.extend([0.0] * (2*len(seen_class_list)))
 
-        seen_text_seqs.extend(negative_text_seqs)
-        seen_class_list.extend([0.0] * len(negative_text_seqs))
+        seen_text_seqs = dataset_index.Text_subset.select(text_seqs, np.concatenate([positive_positions, np.array(negative_positions, dtype=np.int32)]))
+        seen_class_list.extend([0.0] * len(negative_positions))
         assert len(seen_text_seqs) == len(seen_class_list)
 
         print("Text seqs of main class + negative classes: %d" % len(seen_text_seqs))
@@ -105,35 +92,20 @@ class Controller4Reject(train_base.Base_Controller):
 
     def get_binary_test_data(self, text_seqs, class_list):
         print("Creating test dataset for class %d" % (self.main_class))
-        ans_class_list = list()
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                if class_list[idx] == self.main_class:
-                    ans_class_list.append(1.0)
-                else:
-                    ans_class_list.append(0.0)
-                bar.update(idx)
+        ans_class_list = (np.asarray(class_list) == self.main_class).astype(np.float64).tolist()
         assert all([i == 0.0 or i == 1.0 for i in ans_class_list])
         return text_seqs, ans_class_list
 
     def prepro_encode(self, textlist):
-        newtextlist = list()
+        # long texts start at a random position, so unlike the other controllers the padded ids are made per batch
+        startid_list = list()
         for idx, text in enumerate(textlist):
             if len(text[1:-1]) > self.model.max_length:
                 startid = 1 + randint(0, len(text[1:-1]) - self.model.max_length)
             else:
                 startid = 1
-            newtextlist.append(text[startid:-1] + [self.vocab.pad_id])
-        newtextlist = tl.prepro.pad_sequences(newtextlist, maxlen=self.model.max_length, dtype='int64', padding='post', truncating='post', value=self.vocab.pad_id)
-        for idx, text in enumerate(newtextlist):
-            newtextlist[idx] = text[:-1] + [self.vocab.pad_id]
-
-        text_array = np.zeros((len(newtextlist), self.model.max_length, self.model.word_embedding_dim))
-        for idx, text in enumerate(newtextlist):
-            for widx, word_id in enumerate(text):
-                text_array[idx][widx] = self.word_embed_mat[word_id]
-
-        return np.array(newtextlist), text_array
+            startid_list.append(startid)
+        return self.encode_padded_ids(self.get_padded_ids(textlist, startid_list))
 
     def get_adjusted_threshold(trained_pos_logits):
         all_logits = []
@@ -179,7 +151,7 @@ class Controller4Reject(train_base.Base_Controller):
                 self.model.learning_rate,
                 self.model.optim
             ], feed_dict={
-                self.model.encode_seqs: encode_seqs_mat_mini,
+                self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                 self.model.label_logits: np.array(class_idx_mini).reshape(-1,1),
                 self.model.global_step: global_step,
             })
@@ -238,7 +210,7 @@ class Controller4Reject(train_base.Base_Controller):
                 self.model.test_loss,
                 self.model.test_net.outputs,
             ], feed_dict={
-                self.model.encode_seqs: encode_seqs_mat_mini,
+                self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                 self.model.label_logits: np.array(class_idx_mini).reshape(-1,1)
             })
 
@@ -462,7 +434,7 @@ if __name__ == "__main__":
         )
 
         glove_mat = dataloader.load_glove_word_vector(
-            config.word_embed_file_path, config.zhang15_dbpedia_word_embed_matrix_path, vocab, force_process=False
+            config.word_embed_file_path, vocab, force_process=False
         )
         assert np.sum(glove_mat[vocab.start_id]) == 0
         assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -515,7 +487,7 @@ if __name__ == "__main__":
         )
 
         glove_mat = dataloader.load_glove_word_vector(
-            config.word_embed_file_path, config.news20_word_embed_matrix_path, vocab, force_process=False
+            config.word_embed_file_path, vocab, force_process=False
         )
         assert np.sum(glove_mat[vocab.start_id]) == 0
         assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -579,6 +551,7 @@ if __name__ == "__main__":
                     seen_classes=seen_classes,
                     unseen_classes=unseen_classes,
                     max_length=max_length,
+                    word_embed_mat=glove_mat if config.global_feed_word_ids else None,
                 )
                 
                 ctl = Controller4Reject(
@@ -24,6 +24,7 @@ import config
 import model_seen
 import train_base
 import dataloader
+import dataset_index
 
 results_path = "../results/"
 
@@ -90,43 +91,13 @@ class Controller4Seen(train_base.Base_Controller):
     def get_text_of_seen_class(self, text_seqs, class_list):
         print("Getting text of seen classes")
         assert len(text_seqs) == len(class_list)
-        seen_text_seqs = list()
-        seen_class_list = list()
-
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                if self.check_seen(class_list[idx]):
-                    seen_text_seqs.append(text)
-                    seen_class_list.append(class_list[idx])
-                bar.update(idx)
+        positions = dataset_index.get_class_index(class_list).get_positions_except(self.unseen_class)
+        seen_text_seqs = dataset_index.Text_subset.select(text_seqs, positions)
+        seen_class_list = dataset_index.select_classes(class_list, positions)
         assert len(seen_text_seqs) == len(seen_class_list)
         print("Text seqs of seen classes: %d" % len(seen_text_seqs))
         return seen_text_seqs, seen_class_list
 
-    def prepro_encode(self, textlist, is_train):
-        newtextlist = list()
-        for idx, text in enumerate(textlist):
-            # if len(text[1:-1]) > self.model.max_length:
-            #     if is_train:
-            #         startid = 1 + randint(0, len(text[1:-1]) - self.model.max_length)
-            #     else:
-            #         # startid = 1 + (len(text[1:-1]) - self.model.max_length) // 2
-            #         startid = 1
-            # else:
-            #     startid = 1
-            startid = 1
-            newtextlist.append(text[startid:-1] + [self.vocab.pad_id])
-        newtextlist = tl.prepro.pad_sequences(newtextlist, maxlen=self.model.max_length, dtype='int64', padding='post', truncating='post', value=self.vocab.pad_id)
-        for idx, text in enumerate(newtextlist):
-            newtextlist[idx] = text[:-1] + [self.vocab.pad_id]
-
-        text_array = np.zeros((len(newtextlist), self.model.max_length, self.model.word_embedding_dim))
-        for idx, text in enumerate(newtextlist):
-            for widx, word_id in enumerate(text):
-                text_array[idx][widx] = self.word_embed_mat[word_id]
-
-        return np.array(newtextlist), text_array
-
     def get_pred_class_topk(self, pred_mat, k=1):
         assert k > 0
         pred_k = list()
@@ -167,14 +138,13 @@ class Controller4Seen(train_base.Base_Controller):
             train_steps = max_train_steps
 
         train_order = random.sample(range(len(text_seqs)), k=train_steps * config.batch_size)
+        padded_id_matrix = self.get_padded_id_matrix(text_seqs)
 
         for cstep in range(train_steps):
             global_step = cstep + epoch * train_steps
 
             class_idx_mini = [self.seen_class_map2index[class_list[idx]] for idx in train_order[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
-            text_seqs_mini = [text_seqs[idx] for idx in train_order[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
-
-            encode_seqs_id_mini, encode_seqs_mat_mini = self.prepro_encode(text_seqs_mini, True)
+            encode_seqs_id_mini, encode_seqs_mat_mini = self.encode_padded_ids(padded_id_matrix[train_order[cstep * config.batch_size : (cstep + 1) * config.batch_size]])
 
             results = self.sess.run([
                 self.model.train_loss,
@@ -183,7 +153,7 @@ class Controller4Seen(train_base.Base_Controller):
                 self.model.learning_rate,
                 self.model.optim
             ], feed_dict={
-                self.model.encode_seqs: encode_seqs_mat_mini,
+                self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                 self.model.category_target_index: np.array(class_idx_mini),
                 self.model.global_step: global_step,
             })
@@ -220,14 +190,14 @@ class Controller4Seen(train_base.Base_Controller):
         pred_class_list = list()
 
         all_loss = np.zeros(1)
+        padded_id_matrix = self.get_padded_id_matrix(text_seqs)
 
         for cstep in range(test_steps):
 
-            text_seqs_mini = text_seqs[cstep * config.batch_size : (cstep + 1) * config.batch_size]
             class_idx_or_mini = [_ for _ in class_list[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
             class_idx_mini = [self.seen_class_map2index[_] for _ in class_list[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
 
-            encode_seqs_id_mini, encode_seqs_mat_mini = self.prepro_encode(text_seqs_mini, False)
+            encode_seqs_id_mini, encode_seqs_mat_mini = self.encode_padded_ids(padded_id_matrix[cstep * config.batch_size : (cstep + 1) * config.batch_size])
 
             pred_mat = np.zeros([config.batch_size, len(self.class_dict)])
 
@@ -235,7 +205,7 @@ class Controller4Seen(train_base.Base_Controller):
                 self.model.test_loss,
                 self.model.test_net.outputs,
             ], feed_dict={
-                self.model.encode_seqs: encode_seqs_mat_mini,
+                self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                 self.model.category_target_index: class_idx_mini
             })
 
@@ -395,7 +365,7 @@ def run_dbpedia():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.zhang15_dbpedia_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -471,7 +441,8 @@ def run_dbpedia():
                 decay_rate=0.5,
                 decay_steps=10e3,
                 max_length=max_length,
-                number_of_seen_classes=len(rgroup[0])
+                number_of_seen_classes=len(rgroup[0]),
+                word_embed_mat=glove_mat if config.global_feed_word_ids else None,
             )
             # TODO: if unseen_classes are already selected, set randon_unseen_class=False and provide a list of unseen_classes
             gpu_config = tf.ConfigProto()
@@ -502,7 +473,7 @@ def run_20news():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.news20_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -588,7 +559,8 @@ def run_20news():
                 decay_rate=0.5,
                 decay_steps=600,
                 max_length=max_length,
-                number_of_seen_classes=len(rgroup[0])
+                number_of_seen_classes=len(rgroup[0]),
+                word_embed_mat=glove_mat if config.global_feed_word_ids else None,
             )
             # TODO: if unseen_classes are already selected, set randon_unseen_class=False and provide a list of unseen_classes
             gpu_config = tf.ConfigProto()
@@ -618,7 +590,7 @@ def run_amazon():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.chen14_elec_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -678,7 +650,8 @@ def run_amazon():
                 decay_rate=0.5,
                 decay_steps=10000,
                 max_length=max_length,
-                number_of_seen_classes=len(rgroup[0])
+                number_of_seen_classes=len(rgroup[0]),
+                word_embed_mat=glove_mat if config.global_feed_word_ids else None,
             )
             ctl = Controller4Seen(
                 model=mdl,
@@ -25,6 +25,7 @@ import config
 import model_unseen
 import train_base
 import dataloader
+import dataset_index
 
 results_path = "../results/"
 
@@ -53,6 +54,7 @@ class Controller4Unseen(train_base.Base_Controller):
         self.vocab = vocab
         self.class_dict = class_dict
         self.kg_vector_dict = kg_vector_dict
+        self.kg_vector_tensor = None
         self.word_embed_mat = word_embed_mat
         self.lemma = lemma
 
@@ -84,15 +86,9 @@ class Controller4Unseen(train_base.Base_Controller):
     def get_text_of_seen_class(self, text_seqs, class_list):
         print("Getting text of seen classes")
         assert len(text_seqs) == len(class_list)
-        seen_text_seqs = list()
-        seen_class_list = list()
-
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                if self.check_seen(class_list[idx]):
-                    seen_text_seqs.append(text)
-                    seen_class_list.append(class_list[idx])
-                bar.update(idx)
+        positions = dataset_index.get_class_index(class_list).get_positions_except(self.unseen_class)
+        seen_text_seqs = dataset_index.Text_subset.select(text_seqs, positions)
+        seen_class_list = dataset_index.select_classes(class_list, positions)
         assert len(seen_text_seqs) == len(seen_class_list)
         print("Text seqs of seen classes: %d" % len(seen_text_seqs))
         return seen_text_seqs, seen_class_list
@@ -100,56 +96,27 @@ class Controller4Unseen(train_base.Base_Controller):
     def get_text_of_unseen_class(self, text_seqs, class_list, augdata=False):
         print("Getting text of unseen classes")
         assert len(text_seqs) == len(class_list)
-        unseen_text_seqs = list()
-        unseen_class_list = list()
+        class_index = dataset_index.get_class_index(class_list)
 
+        # control the number of augmented data
+        max_per_class = config.augmentation if augdata else None
         unseen_class_counter = dict()
         for c in self.unseen_class:
-            unseen_class_counter[c] = 0
+            unseen_class_counter[c] = min(class_index.get_count(c), max_per_class) if augdata else class_index.get_count(c)
 
-        with progressbar.ProgressBar(max_value=len(text_seqs)) as bar:
-            for idx, text in enumerate(text_seqs):
-                if not self.check_seen(class_list[idx]):
-
-                    # control the number of augmented data
-                    if augdata and unseen_class_counter[class_list[idx]] >= config.augmentation:
-                        continue
-
-                    unseen_class_counter[class_list[idx]] += 1
-
-                    unseen_text_seqs.append(text)
-                    unseen_class_list.append(class_list[idx])
-                bar.update(idx)
+        positions = class_index.get_positions(self.unseen_class, max_per_class)
+        unseen_text_seqs = dataset_index.Text_subset.select(text_seqs, positions)
+        unseen_class_list = dataset_index.select_classes(class_list, positions)
         assert len(unseen_text_seqs) == len(unseen_class_list)
         print("Text seqs of unseen classes: %d" % len(unseen_text_seqs))
         if augdata:
             print("Augmented data num of each unseen class {%s}" % (", ".join(["%s:%s" % (k, v) for k, v in unseen_class_counter.items()])))
         return unseen_text_seqs, unseen_class_list
 
-    def prepro_encode(self, textlist):
-        newtextlist = list()
-        for idx, text in enumerate(textlist):
-            # if len(text[1:-1]) > self.model.max_length:
-            #     startid = 1 + randint(0, len(text[1:-1]) - self.model.max_length)
-            # else:
-            #     startid = 1
-            startid = 1
-            newtextlist.append(text[startid:-1] + [self.vocab.pad_id])
-        newtextlist = tl.prepro.pad_sequences(newtextlist, maxlen=self.model.max_length, dtype='int64', padding='post', truncating='post', value=self.vocab.pad_id)
-        for idx, text in enumerate(newtextlist):
-            newtextlist[idx] = text[:-1] + [self.vocab.pad_id]
-
-        text_array = np.zeros((len(newtextlist), self.model.max_length, self.model.word_embedding_dim))
-        for idx, text in enumerate(newtextlist):
-            for widx, word_id in enumerate(text):
-                text_array[idx][widx] = self.word_embed_mat[word_id]
-
-        return np.array(newtextlist), text_array
-
     def get_random_text(self, num):
         random_text = list()
         for i in range(num):
-            text = [randint(0, self.vocab.unk_id) for _ in range(self.model.max_length)]
+            text = [randint(0, dataloader.get_vocab_size(self.vocab) - 1) for _ in range(self.model.max_length)]
             random_text.append(text)
         return random_text
 
@@ -181,6 +148,25 @@ class Controller4Unseen(train_base.Base_Controller):
 
         return class_embed
 
+    def get_kg_word(self, word):
+        if self.lemma:
+            new_word = nltk.pos_tag([word])  # a list of words à a list of words with part of speech
+            new_word = [self.lemmatizer.lemmatize(t[0], config.pos_dict[t[1]]) for t in new_word if t[1] in config.pos_dict]
+            if len(new_word) > 0:
+                word = new_word[0]
+        return word
+
+    def load_kg_vector_tensor(self, filedir, fileprefix, npyfilename, force_process=False):
+        # KG vectors of every (class, vocab word) pair, so that get_kg_vector_given_class is a single array lookup.
+        # The words are looked up as themselves or as their lemmas, in a tensor of its own (npyfilename with _LEMMA)
+        if self.lemma:
+            npyfilename = "%s_LEMMA.npy" % os.path.splitext(npyfilename)[0]
+        self.kg_vector_tensor = dataloader.load_kg_vector_tensor(
+            filedir, fileprefix, self.class_dict, self.vocab, npyfilename,
+            word_fn=self.get_kg_word if self.lemma else None, word_fn_params={'lemma': True} if self.lemma else None,
+            force_process=force_process
+        )
+
     def get_kg_vector_given_class(self, encode_text_seqs, class_id_list):
 
         # TODO: remove to add kg_vector for training
@@ -188,24 +174,23 @@ class Controller4Unseen(train_base.Base_Controller):
 
         assert encode_text_seqs.shape[0] == class_id_list.shape[0]
 
-        kg_vector_list = list()
+        if self.kg_vector_tensor is not None:
+            kg_vector_list = dataloader.get_kg_vector_seqs(self.kg_vector_tensor, class_id_list, encode_text_seqs)
 
-        for idx, class_id in enumerate(class_id_list):
+        else:
+            kg_vector_list = list()
+
+            for idx, class_id in enumerate(class_id_list):
 
-            kg_vector = np.zeros([self.model.max_length, config.kg_embedding_dim])
+                kg_vector = np.zeros([self.model.max_length, config.kg_embedding_dim])
 
-            for widx, word_id in enumerate(encode_text_seqs[idx]):
-                word = self.vocab.id_to_word(word_id)
-                if self.lemma:
-                    new_word = nltk.pos_tag([word])  # a list of words à a list of words with part of speech
-                    new_word = [self.lemmatizer.lemmatize(t[0], config.pos_dict[t[1]]) for t in new_word if t[1] in config.pos_dict]
-                    if len(new_word) > 0:
-                        word = new_word[0]
-                kg_vector[widx, :] = dataloader.get_kg_vector(self.kg_vector_dict, self.class_dict[class_id], word)
+                for widx, word_id in enumerate(encode_text_seqs[idx]):
+                    word = self.get_kg_word(self.vocab.id_to_word(word_id))
+                    kg_vector[widx, :] = dataloader.get_kg_vector(self.kg_vector_dict, self.class_dict[class_id], word)
 
-            kg_vector_list.append(kg_vector)
+                kg_vector_list.append(kg_vector)
 
-        kg_vector_list = np.array(kg_vector_list)
+            kg_vector_list = np.array(kg_vector_list)
 
         assert kg_vector_list.shape == (config.batch_size, self.model.max_length, config.kg_embedding_dim)
 
@@ -251,6 +236,7 @@ class Controller4Unseen(train_base.Base_Controller):
             train_steps = max_train_steps
 
         train_order = random.sample(range(len(text_seqs)), k=train_steps * config.batch_size)
+        padded_id_matrix = self.get_padded_id_matrix(text_seqs)
 
         for cstep in range(train_steps):
             global_step = cstep + epoch * train_steps
@@ -260,18 +246,18 @@ class Controller4Unseen(train_base.Base_Controller):
             # category_logits = [1 if randint(0, config.negative_sample + epoch * 3) == 0 else 0 for _ in range(config.batch_size)]
 
             true_class_id_mini = [class_list[idx] for idx in train_order[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
-            text_seqs_mini = [text_seqs[idx] for idx in train_order[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
+            encode_seqs_id_mini = padded_id_matrix[train_order[cstep * config.batch_size : (cstep + 1) * config.batch_size]]
 
             if not config.model == "autoencoder":
                 # random text
                 true_class_id_mini = true_class_id_mini[:-3]  + [-1, -1, -1]
-                text_seqs_mini = text_seqs_mini[:-3] + self.get_random_text(3)
+                encode_seqs_id_mini[-3:] = self.get_padded_ids(self.get_random_text(3))
             else:
                 tmpid = random.choice(list(self.class_dict.keys()))
-                text_seqs_mini = text_seqs_mini[:-1] + \
-                                 [[self.vocab.start_id, self.vocab.word_to_id(self.class_dict[tmpid]), self.vocab.end_id]]
+                encode_seqs_id_mini[-1:] = self.get_padded_ids(
+                                 [[self.vocab.start_id, self.vocab.word_to_id(self.class_dict[tmpid]), self.vocab.end_id]])
 
-            encode_seqs_id_mini, encode_seqs_mat_mini = self.prepro_encode(text_seqs_mini)
+            encode_seqs_id_mini, encode_seqs_mat_mini = self.encode_padded_ids(encode_seqs_id_mini, need_embeddings=config.model == "autoencoder")
 
             # for class_id in seen_class_list:
 
@@ -289,7 +275,7 @@ class Controller4Unseen(train_base.Base_Controller):
                     self.model.learning_rate,
                     self.model.optim
                 ], feed_dict={
-                    self.model.encode_seqs: encode_seqs_mat_mini,
+                    self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                     self.model.class_label_seqs: class_label_embed_mini,
                     self.model.category_logits: np.expand_dims(np.array(category_logits), -1),
                     self.model.global_step: global_step,
@@ -306,7 +292,7 @@ class Controller4Unseen(train_base.Base_Controller):
                     self.model.learning_rate,
                     self.model.optim
                 ], feed_dict={
-                    self.model.encode_seqs: encode_seqs_mat_mini,
+                    self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                     self.model.decode_seqs: decode_seqs_mat_mini,
                     self.model.global_step: global_step,
                     self.model.target_seqs: encode_seqs_id_mini,
@@ -325,7 +311,7 @@ class Controller4Unseen(train_base.Base_Controller):
                     self.model.learning_rate,
                     self.model.optim
                 ], feed_dict={
-                    self.model.encode_seqs: encode_seqs_mat_mini,
+                    self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                     self.model.class_label_seqs: class_label_embed_mini,
                     self.model.kg_vector: kg_vector_seqs_mini,
                     self.model.category_logits: np.expand_dims(np.array(category_logits), -1),
@@ -377,18 +363,17 @@ class Controller4Unseen(train_base.Base_Controller):
             if class_id not in class_text_state_dict:
                 class_text_state_dict[class_id] = class_text_state[cidx]
 
+        padded_id_matrix = self.get_padded_id_matrix(text_seqs)
         for cstep in range(test_steps):
 
-            text_seqs_mini = text_seqs[cstep * config.batch_size : (cstep + 1) * config.batch_size]
-
-            encode_seqs_id_mini, encode_seqs_mat_mini = self.prepro_encode(text_seqs_mini)
+            encode_seqs_id_mini, encode_seqs_mat_mini = self.encode_padded_ids(padded_id_matrix[cstep * config.batch_size : (cstep + 1) * config.batch_size])
 
             pred_mat = np.zeros([config.batch_size, len(self.class_dict)])
 
             test_text_state  = self.sess.run([
                 self.model.test_text_state,
             ], feed_dict={
-                self.model.encode_seqs: encode_seqs_mat_mini,
+                self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
             })
             test_text_state = test_text_state[0][0]
 
@@ -468,12 +453,12 @@ class Controller4Unseen(train_base.Base_Controller):
 
         # kg_vector_list = list()
 
+        padded_id_matrix = self.get_padded_id_matrix(text_seqs)
         for cstep in range(test_steps):
 
-            text_seqs_mini = text_seqs[cstep * config.batch_size : (cstep + 1) * config.batch_size]
             true_class_id_mini = class_list[cstep * config.batch_size : (cstep + 1) * config.batch_size]
 
-            encode_seqs_id_mini, encode_seqs_mat_mini = self.prepro_encode(text_seqs_mini)
+            encode_seqs_id_mini, encode_seqs_mat_mini = self.encode_padded_ids(padded_id_matrix[cstep * config.batch_size : (cstep + 1) * config.batch_size])
 
             pred_mat = np.zeros([config.batch_size, len(self.class_dict)])
             # align_mat = np.zeros([config.batch_size, len(self.class_dict), self.model.max_length - 1])
@@ -497,7 +482,7 @@ class Controller4Unseen(train_base.Base_Controller):
                         self.model.test_loss,
                         self.model.test_net.outputs,
                     ], feed_dict={
-                        self.model.encode_seqs: encode_seqs_mat_mini,
+                        self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                         self.model.class_label_seqs: class_label_embed_mini,
                         self.model.category_logits: category_logits,
                     })
@@ -512,7 +497,7 @@ class Controller4Unseen(train_base.Base_Controller):
                         self.model.test_net.outputs,
                         # self.model.test_align.outputs,
                     ], feed_dict={
-                        self.model.encode_seqs: encode_seqs_mat_mini,
+                        self.model.encode_seqs_input: self.get_encode_seqs_input(encode_seqs_id_mini, encode_seqs_mat_mini),
                         self.model.class_label_seqs: class_label_embed_mini,
                         self.model.kg_vector: kg_vector_seqs_mini,
                         self.model.category_logits: category_logits,
@@ -792,7 +777,7 @@ def run_dbpedia():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.zhang15_dbpedia_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -812,14 +797,8 @@ def run_dbpedia():
         assert class_label_word_id != vocab.unk_id
         assert np.sum(glove_mat[class_label_word_id]) != 0
 
-    if config.model == "cnnfc" or config.model == "rnnfc" or config.model == "vwvc" or config.model == "autoencoder":
-        kg_vector_dict = dict()
-    else:
-        kg_vector_dict = dataloader.load_kg_vector(
-            config.zhang15_dbpedia_kg_vector_dir,
-            config.zhang15_dbpedia_kg_vector_prefix,
-            class_dict
-        )
+    # KG vectors are loaded by the controller as a [num_classes, vocab_size, kg_embedding_dim] tensor
+    kg_vector_dict = dict()
 
     print("Check NaN in csv ...")
     check_nan_train = dataloader.check_df(config.zhang15_dbpedia_train_path)
@@ -918,7 +897,8 @@ def run_dbpedia():
                 decay_rate=0.8,
                 decay_steps=2e3,
                 max_length=max_length,
-                vocab_size=vocab.unk_id + 1,
+                vocab_size=dataloader.get_vocab_size(vocab),
+                word_embed_mat=glove_mat if config.global_feed_word_ids else None,
             )
             # TODO: if unseen_classes are already selected, set randon_unseen_class=False and provide a list of unseen_classes
             gpu_config = tf.ConfigProto()
@@ -935,6 +915,8 @@ def run_dbpedia():
                 random_unseen_class_list=rgroup[1],
                 base_epoch=-1,
             )
+            if config.model not in ["cnnfc", "rnnfc", "vwvc", "autoencoder"]:
+                ctl.load_kg_vector_tensor(config.zhang15_dbpedia_kg_vector_dir, config.zhang15_dbpedia_kg_vector_prefix, config.zhang15_dbpedia_kg_vector_tensor_path)
             if config.global_is_train:
                 ctl.controller(train_text_seqs, train_class_list,
                                train_aug_text_seqs_from_seen, train_aug_class_list_from_seen,
@@ -958,7 +940,7 @@ def run_20news():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.news20_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -978,14 +960,8 @@ def run_20news():
         assert class_label_word_id != vocab.unk_id
         assert np.sum(glove_mat[class_label_word_id]) != 0
 
-    if config.model == "cnnfc" or config.model == "rnnfc" or config.model == "vwvc" or config.model == "autoencoder":
-        kg_vector_dict = dict()
-    else:
-        kg_vector_dict = dataloader.load_kg_vector(
-            config.news20_kg_vector_dir,
-            config.news20_kg_vector_prefix,
-            class_dict
-        )
+    # KG vectors are loaded by the controller as a [num_classes, vocab_size, kg_embedding_dim] tensor
+    kg_vector_dict = dict()
 
     print("Check NaN in csv ...")
     check_nan_train = dataloader.check_df(config.news20_train_path)
@@ -1084,7 +1060,8 @@ def run_20news():
                 decay_rate=0.5,
                 decay_steps=600,
                 max_length=max_length,
-                vocab_size=vocab.unk_id + 1,
+                vocab_size=dataloader.get_vocab_size(vocab),
+                word_embed_mat=glove_mat if config.global_feed_word_ids else None,
             )
             # TODO: if unseen_classes are already selected, set randon_unseen_class=False and provide a list of unseen_classes
             gpu_config = tf.ConfigProto()
@@ -1101,6 +1078,8 @@ def run_20news():
                 random_unseen_class_list=rgroup[1],
                 base_epoch=-1,
             )
+            if config.model not in ["cnnfc", "rnnfc", "vwvc", "autoencoder"]:
+                ctl.load_kg_vector_tensor(config.news20_kg_vector_dir, config.news20_kg_vector_prefix, config.news20_kg_vector_tensor_path)
             if config.global_is_train:
                 ctl.controller(train_text_seqs, train_class_list,
                                train_aug_text_seqs_from_seen, train_aug_class_list_from_seen,
@@ -1122,7 +1101,7 @@ def run_amazon():
     )
 
     glove_mat = dataloader.load_glove_word_vector(
-        config.word_embed_file_path, config.chen14_elec_word_embed_matrix_path, vocab, force_process=False
+        config.word_embed_file_path, vocab, force_process=False
     )
     assert np.sum(glove_mat[vocab.start_id]) == 0
     assert np.sum(glove_mat[vocab.end_id]) == 0
@@ -1202,7 +1181,8 @@ def run_amazon():
                 start_learning_rate=0.0001,
                 decay_rate=0.5,
                 decay_steps=2000,
-                max_length=max_length
+                max_length=max_length,
+                word_embed_mat=glove_mat if config.global_feed_word_ids else None,
             )
             # TODO: if unseen_classes are already selected, set randon_unseen_class=False and provide a list of unseen_classes
             ctl = Controller4Unseen(
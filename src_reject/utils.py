@@ -1,5 +1,6 @@
 
 import os
+import hashlib
 import numpy as np
 from datetime import datetime
 
@@ -21,6 +22,26 @@ def make_dirlist(dirlist):
         if not os.path.exists(dir):
             os.makedirs(dir)
 
+def hash_of_string(s):
+    return hashlib.sha1(s.encode('utf8')).hexdigest()
+
+def hash_of_array(array):
+    array = np.ascontiguousarray(array)
+    sha1 = hashlib.sha1(("%s|%s|" % (array.dtype.str, array.shape)).encode('utf8'))
+    sha1.update(array.tobytes())
+    return sha1.hexdigest()
+
+def file_fingerprint(filename, block_size=1 << 20):
+    # Size plus the first and the last block of the file: cheap to compute for multi-GB files
+    size = os.path.getsize(filename)
+    sha1 = hashlib.sha1(str(size).encode('utf8'))
+    with open(filename, 'rb') as f:
+        sha1.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(size - block_size, block_size))
+            sha1.update(f.read(block_size))
+    return sha1.hexdigest()
+
 def get_precision_recall_f1(prediction, ground_truth, with_confusion_matrix = False): # 1D data
     # print(prediction.shape, ground_truth.shape, prediction.ndim)
     assert prediction.shape == ground_truth.shape and prediction.ndim == 1